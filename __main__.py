@@ -0,0 +1,5 @@
+import sys
+from main import main
+
+# lets the whole directory be run as a program, e.g. `python rollpy 1d20`
+main(sys.argv[1:])
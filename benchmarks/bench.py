@@ -0,0 +1,252 @@
+"""Benchmarks of parsing, macro expansion, execution, statistics and startup, with results saved as JSON to compare between commits.
+
+Usage:
+  python benchmarks/bench.py [-o results.json] [-k pattern] [--quick]
+  python benchmarks/bench.py --compare old.json new.json
+
+Every workload is generated with fixed seeds, so runs on different commits time the same work."""
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import character
+import dicerng
+import expansion
+import lexer
+import main
+import render
+import statistic
+import table
+import tags
+from group import Group
+from roll import Roll
+from grouping import make_args
+
+# map from name to a setup function, which returns the function to time
+benchmarks = {}
+
+def benchmark(name: str, loops: int = None):
+    """Registers a setup function under the given name. loops: a fixed number of loops per repeat, for slow benchmarks."""
+    def register(setup):
+        benchmarks[name] = (setup, loops)
+        return setup
+    return register
+
+class _ChainResolver:
+    """Resolves macros from a map, in place of the current character, so that the benchmarks do not touch the stores."""
+    def __init__(self, macros: dict):
+        self.character = None
+        self.macros = macros
+
+    def get_roll(self, macro: str) -> str:
+        return self.macros.get(macro)
+
+def _parse(line: str) -> list:
+    args = expansion.Expander(_ChainResolver({})).expand(line.split())
+    main.group_commas(args)
+    return args
+
+# Rolls
+
+_specs = ["{}d{}{}".format(count, die, option) for count in [1, 2, 4, 8] for die in [4, 6, 8, 10, 12, 20] for option in ["", "+3", "h1", "r1", "l2-1"]]
+
+@benchmark("roll.parse")
+def _():
+    # the lexer caches what it has seen, so the cache is cleared to time the parsing itself
+    def parse():
+        lexer.lex.cache_clear()
+        for spec in _specs:
+            Roll(spec)
+    return parse
+
+def _roll_run(spec: str, method: str):
+    def setup():
+        execute, rng = getattr(Roll(spec), method), dicerng.DiceRNG(0)
+        return lambda: execute(rng)
+    return setup
+
+for _spec in ["1d20", "4d6h3", "8d6r1", "100d6"]:
+    benchmark("roll.run." + _spec)(_roll_run(_spec, "run"))
+    benchmark("roll.evaluate." + _spec)(_roll_run(_spec, "evaluate"))
+benchmark("roll.run.10000d6h10")(_roll_run("10000d6h10", "run"))
+benchmark("roll.evaluate.100000d6r1")(_roll_run("100000d6r1", "evaluate"))
+benchmark("roll.run.1000000d6r1h10")(_roll_run("1000000d6r1h10", "run"))
+
+# Groups
+
+_group_lines = {
+    "nested": "[ [ 1d20 1d4 ] [ 2d6 , 1d8 ] ] [ [ 1d4 ] [ [ 1d6 -mean ] ] ] -std",
+    "supertags": "[ [ 1d20 1d4 ] [ 2d6 1d8 ] ] [ 1d4 1d6 ] --verbose --mean --hide",
+    "multiplied": "[ 1d20 .+5 1d8 ] x1000 -mean",
+}
+
+def _group_parse(line: str):
+    def setup():
+        args = _parse(line)
+        return lambda: Group(list(args))
+    return setup
+
+def _group_run(line: str):
+    def setup():
+        group = Group(_parse(line))
+        rng = dicerng.DiceRNG(0)
+        return lambda: group.run(rng)
+    return setup
+
+for _name, _line in _group_lines.items():
+    benchmark("group.parse." + _name)(_group_parse(_line))
+    benchmark("group.run." + _name)(_group_run(_line))
+benchmark("group.simulate.4d6h3x6")(_group_run("[ 4d6h3 ] x6 -sim 1000 -mean -median"))
+
+def _render(collapse: int):
+    def setup():
+        result = Group(_parse("[ 1d20 ] x5000 -verbose")).run(dicerng.DiceRNG(0))
+        return lambda: render.plain(result, collapse)
+    return setup
+
+benchmark("render.full.x5000")(_render(0))
+benchmark("render.collapsed.x5000")(_render(100))
+
+@benchmark("group.commas.10k")
+def _():
+    args = [part for arg in make_args(10000) for part in expansion.expand_delimiters(arg)]
+    return lambda: main.group_commas(list(args))
+
+# Macro expansion
+
+def _chain(depth: int, width: int) -> dict:
+    """Returns macros m0..m{depth} where each expands into the next one, several times over, and the last is a roll."""
+    macros = {"m{}".format(i): " ".join(["m{}".format(i + 1)] * (width if i % 8 == 0 else 1)) for i in range(depth)}
+    macros["m{}".format(depth)] = "[1d20+5,1d8+3]"
+    return macros
+
+def _expand(depth: int, warm: bool):
+    def setup():
+        resolver = _ChainResolver(_chain(depth, 2))
+        def expand():
+            if not warm:
+                character.unload_characters() # forgets the memoized expansions
+            return expansion.Expander(resolver).expand(["m0", "-mean"])
+        return expand
+    return setup
+
+benchmark("expand.chain50.cold")(_expand(50, False))
+benchmark("expand.chain50.warm")(_expand(50, True))
+
+# Statistics
+
+_rng = dicerng.DiceRNG(0)
+_outcomes = [a + b for a, b in zip(_rng.dice(20, 10000), _rng.dice(6, 10000))]
+
+@benchmark("statistic.accumulate.10k")
+def _():
+    return lambda: statistic.Accumulator(_outcomes, keep_counts=True)
+
+@benchmark("statistic.all.10k")
+def _():
+    acc = statistic.Accumulator(_outcomes, keep_counts=True)
+    return lambda: [tags.calculate(stat, acc) for stat in tags.stat_tag_strs]
+
+# Random tables
+
+_table_weights = [1 + i % 7 for i in range(10000)]
+
+@benchmark("table.build.10k")
+def _():
+    rows = ["row {}".format(i) for i in range(len(_table_weights))]
+    return lambda: table.RandomTable("bench", rows, _table_weights)
+
+@benchmark("table.draw.10k")
+def _():
+    random_table, rng = table.RandomTable("bench", ["row {}".format(i) for i in range(len(_table_weights))], _table_weights), dicerng.DiceRNG(0)
+    return lambda: random_table.draw(rng)
+
+# Characters
+
+@benchmark("character.get_roll")
+def _():
+    char = character.Character("Bench", {stat: i - 1 for i, stat in enumerate(character.stats)}, 7, {"dexsave": 1}, {"stealth": 2, "arcana": 1})
+    char.macros = {"attack": "1d20+7", "damage": "2d6+4"}
+    names = character.stats + list(character.saves) + list(character.skills) + list(character.mods) + ["prof", "level", "attack", "damage", "nothing"]
+    def lookup():
+        for name in names:
+            char.get_roll(name)
+    return lookup
+
+# Startup
+
+@benchmark("startup.main", loops=1)
+def _():
+    return lambda: subprocess.run([sys.executable, os.path.join(ROOT, "main.py"), "--seed=0", "--format=plain", "1d20"], cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+
+def measure(func, loops: int = None, repeat: int = 5, min_time: float = 0.1) -> dict:
+    """Times func, in microseconds per call, over several repeats of enough loops to take at least min_time seconds."""
+    func() # warm up caches and buffers
+    if loops is None:
+        loops = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(loops):
+                func()
+            if time.perf_counter() - start >= min_time:
+                break
+            loops *= 2
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        times.append((time.perf_counter() - start) / loops * 1e6)
+    return {"loops": loops, "times_us": times, "min_us": min(times), "mean_us": statistics.mean(times), "stdev_us": statistics.stdev(times) if len(times) > 1 else 0.0}
+
+def _commit() -> str:
+    proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    return proc.stdout.strip() or None
+
+def run(pattern: str = "", quick: bool = False) -> dict:
+    """Runs every benchmark whose name matches the pattern, printing each result. Returns the results with metadata."""
+    results = {}
+    for name, (setup, loops) in benchmarks.items():
+        if not re.search(pattern, name):
+            continue
+        result = measure(setup(), loops, repeat=3 if quick else 5, min_time=0.02 if quick else 0.1)
+        print("{:<32} {:>12.2f} us  (+- {:.2f})".format(name, result["min_us"], result["stdev_us"]))
+        results[name] = result
+    meta = {"commit": _commit(), "python": platform.python_version(), "machine": platform.machine(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    return {"meta": meta, "benchmarks": results}
+
+def compare(old: dict, new: dict):
+    """Prints the fastest time of each benchmark in both results, and how many times faster the new one is."""
+    print("{:<32} {:>12} {:>12} {:>8}".format("benchmark", old["meta"]["commit"] or "old", new["meta"]["commit"] or "new", "speedup"))
+    for name, result in new["benchmarks"].items():
+        if name in old["benchmarks"]:
+            before, after = old["benchmarks"][name]["min_us"], result["min_us"]
+            print("{:<32} {:>10.2f}us {:>10.2f}us {:>7.2f}x".format(name, before, after, before / after))
+        else:
+            print("{:<32} {:>12} {:>10.2f}us".format(name, "-", result["min_us"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks rollpy.")
+    parser.add_argument("-o", "--output", help="file to save the results to, as JSON")
+    parser.add_argument("-k", "--pattern", default="", help="only run benchmarks whose names match this regex")
+    parser.add_argument("--quick", action="store_true", help="use fewer and shorter repeats")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two saved results instead of running")
+    options = parser.parse_args()
+
+    if options.compare:
+        with open(options.compare[0]) as old, open(options.compare[1]) as new:
+            compare(json.load(old), json.load(new))
+    else:
+        results = run(options.pattern, options.quick)
+        if options.output:
+            with open(options.output, "w") as fp:
+                json.dump(results, fp, indent=2)
@@ -0,0 +1,27 @@
+"""Times the comma/bracket preprocessing in main.py on generated inputs, to check that it scales linearly.
+
+Usage: python benchmarks/grouping.py"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import expansion
+from main import group_commas
+
+def make_args(n: int) -> list:
+    """Returns about n args of nested, comma-separated rolls, e.g. "[1d20,1d4],[2d6,1d8]"."""
+    return ["[1d20,1d4],[2d6,1d8]"] * (n // 11) # 11 tokens each
+
+def time_it(n: int) -> float:
+    args = make_args(n)
+    start = time.perf_counter()
+    tokens = [part for arg in args for part in expansion.expand_delimiters(arg)]
+    group_commas(tokens)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    for n in [1000, 10000, 100000, 1000000]:
+        elapsed = time_it(n)
+        print("{:>8} tokens: {:8.2f} ms ({:.3f} us/token)".format(n, elapsed * 1000, elapsed * 1e6 / n))
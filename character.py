@@ -1,11 +1,13 @@
-import pickle
-from os import path, getcwd
+import json
+import sqlite3
+from os import path
 from util import PATH_TO_DIR, ParseException
-import modifier
 import expression
 from macros import assert_valid_macro
+import profiling
 
-characters_file_path = PATH_TO_DIR + "/characters.txt"
+characters_db_path = PATH_TO_DIR + "/characters.db"
+characters_file_path = PATH_TO_DIR + "/characters.txt" # the old pickle file, imported into the database on first use
 current_character_file_path = PATH_TO_DIR + "/currentCharacter.txt"
 
 stats = ["str", "dex", "con", "int", "wis", "cha"]
@@ -47,37 +49,45 @@ class Character:
         self.save_proficiencies = saveprofs
         self.skill_proficiencies = skillprofs
         self.macros = {}
+        self._rolls = None # what each macro expands into, made on first use
+
+    def __setstate__(self, state: dict):
+        # characters unpickled from the old file are made without __init__, and from before _rolls existed
+        self.__dict__.update(state)
+        self._rolls = None
     
     def get_roll(self, macro: str) -> str:
         """
         macro: e.g. "acro" or "ints" or "dex", or a character-specific macro\n
         return: a die string, e.g. "1d20+2"
         """
-        # check character-specfic macro
-        if macro in self.macros:
-            return self.macros[macro]
-
-        # check various rolls
-        bonus = None
-        if macro in stats:
-            bonus = self.modifiers[macro]
-        elif macro in saves:
-            bonus = self.modifiers[saves[macro]] + self.proficiency_bonus * self.save_proficiencies.get(macro, 0)
-        elif macro in skills:
-            bonus = self.modifiers[skills[macro]] + self.proficiency_bonus * self.skill_proficiencies.get(macro, 0)
-        if not bonus is None:
-            return "1d20{0:+d}".format(int(bonus))
-        
-        # check if modifier (the dnd kind, not the rollpy kind)
-        if macro in mods:
-            return expression.get_expression(self.modifiers[mods[macro]], label=macro)
-        elif macro == "prof":
-            return expression.get_expression(self.proficiency_bonus, label=macro)
-        elif macro == "level":
-            return expression.get_expression(self.level, label=macro)
+        if self._rolls is None:
+            self._rolls = self._make_rolls()
+        return self._rolls.get(macro)
+    
+    def _make_rolls(self) -> dict:
+        """Returns a map from every macro of this character to what it expands into."""
+        rolls = {}
+
+        # various rolls
+        for stat in stats:
+            rolls[stat] = self.modifiers[stat]
+        for save, stat in saves.items():
+            rolls[save] = self.modifiers[stat] + self.proficiency_bonus * self.save_proficiencies.get(save, 0)
+        for skill, stat in skills.items():
+            rolls[skill] = self.modifiers[stat] + self.proficiency_bonus * self.skill_proficiencies.get(skill, 0)
+        for macro, bonus in rolls.items():
+            rolls[macro] = "1d20{0:+d}".format(int(bonus))
         
-        # no matches for macro
-        return None
+        # modifiers (the dnd kind, not the rollpy kind)
+        for mod, stat in mods.items():
+            rolls[mod] = expression.get_expression(self.modifiers[stat], label=mod)
+        rolls["prof"] = expression.get_expression(self.proficiency_bonus, label="prof")
+        rolls["level"] = expression.get_expression(self.level, label="level")
+
+        # character-specific macros take precedence
+        rolls.update(self.macros)
+        return rolls
     
     @property
     def proficiency_bonus(self) -> int:
@@ -108,60 +118,175 @@ class Character:
             self.level = int(newval)
         else:
             raise KeyError(attribute)
+        self._rolls = None
     
     def add_macro(self, macro: str, value: str):
         """Adds the macro to the character. This can be used to override attribute macros, or just to add new functionality altogether."""
         self.macros[macro] = value
+        self._rolls = None
     
     def delete_macro(self, macro: str):
         del self.macros[macro]
+        self._rolls = None
         
-# Character usage
+# Character storage: one row per character and one row per character macro, so that changes are written incrementally
+# and each character is only loaded when it is used
+
+_connection = None
 
-def _load_characters() -> dict:
-    """return: map from name to Character"""
+def _connect() -> sqlite3.Connection:
+    """Returns the connection to the character database, creating the database on first use."""
+    global _connection
+    if _connection is None:
+        is_new = not path.exists(characters_db_path)
+        _connection = sqlite3.connect(characters_db_path)
+        with _connection:
+            _connection.execute("CREATE TABLE IF NOT EXISTS characters (name TEXT PRIMARY KEY, level INTEGER, modifiers TEXT, save_proficiencies TEXT, skill_proficiencies TEXT)")
+            _connection.execute("CREATE TABLE IF NOT EXISTS character_macros (character TEXT, macro TEXT, value TEXT, PRIMARY KEY (character, macro))")
+        if is_new:
+            _import_pickled_characters()
+        (version,) = _connection.execute("PRAGMA user_version").fetchone()
+        if version < schema_version:
+            with _connection as db:
+                _migrate(db, version)
+    return _connection
+
+# the version of the database's contents, kept as its user_version; see _migrate()
+schema_version = 1
+
+def _migrate(db: sqlite3.Connection, version: int):
+    """Brings the contents of a database from the given version up to schema_version."""
+    if version < 1:
+        # expressions were evaluated from left to right before version 1, so they are given the parentheses that keep their meaning
+        rows = db.execute("SELECT character, macro, value FROM character_macros").fetchall()
+        db.executemany("UPDATE character_macros SET value = ? WHERE character = ? AND macro = ?",
+                       [(migrated, name, macro) for name, macro, value in rows if (migrated := expression.left_to_right_args(value)) != value])
+    db.execute("PRAGMA user_version = {}".format(schema_version))
+
+def _import_pickled_characters():
+    """Copies the characters from the old pickle file, if it exists, into the database."""
     if not path.exists(characters_file_path):
-        return {}
+        return
+    import pickle
+    profiling.count("file reads")
     with open(characters_file_path, "rb") as fp:
-        return pickle.load(fp)
-    
-# load the characters only once at the start of execution
-characters = _load_characters()
+        characters = pickle.load(fp).values()
+    # only the rows are written; each character is loaded from the database like any other when it is used
+    with _connection as db:
+        for character in characters:
+            _save_character_row(db, character)
+            db.executemany("INSERT INTO character_macros VALUES (?, ?, ?)", [(character.name, macro, value) for macro, value in character.macros.items()])
+
+# characters that have been loaded, by name
+_loaded = {}
 
-def save_characters(characters: dict):
-    """Saves a map from name to Character to file"""
-    with open(characters_file_path, "wb") as fp:
-        return pickle.dump(characters, fp)
+# changes whenever any character changes, so that anything derived from the characters knows to update
+version = 0
+
+def _changed():
+    global version
+    version += 1
+
+def unload_characters():
+    """Forgets the loaded characters, so that they are loaded from the database again on next use."""
+    _loaded.clear()
+    _changed()
+
+def get_character(name: str) -> Character:
+    """Returns the character with the given name, or None if there is no such character."""
+    if name in _loaded:
+        return _loaded[name]
+    db = _connect()
+    profiling.count("database reads")
+    row = db.execute("SELECT level, modifiers, save_proficiencies, skill_proficiencies FROM characters WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        return None
+    level, modifiers, saveprofs, skillprofs = row
+    character = Character(name, json.loads(modifiers), level, json.loads(saveprofs), json.loads(skillprofs))
+    character.macros = dict(db.execute("SELECT macro, value FROM character_macros WHERE character = ?", (name,)))
+    _loaded[name] = character
+    return character
+
+def get_character_names() -> list:
+    """Returns the names of all characters."""
+    profiling.count("database reads")
+    return [name for name, in _connect().execute("SELECT name FROM characters ORDER BY rowid")]
+
+def _save_character_row(db: sqlite3.Connection, character: Character):
+    db.execute(
+        "INSERT INTO characters VALUES (?, ?, ?, ?, ?) ON CONFLICT (name) DO UPDATE SET "
+        "level = excluded.level, modifiers = excluded.modifiers, save_proficiencies = excluded.save_proficiencies, skill_proficiencies = excluded.skill_proficiencies",
+        (character.name, character.level, json.dumps(character.modifiers), json.dumps(character.save_proficiencies), json.dumps(character.skill_proficiencies)))
 
 def get_character_roll(name: str, macro: str) -> str:
     """Loads the specified character and makes a roll. Returns none if invalid."""
-    if name in characters:
-        return characters[name].get_roll(macro)
+    if character := get_character(name):
+        return character.get_roll(macro)
     else:
         return None
 
 # Current character management and usage
 
+# the current character's name, and the modification time of the file it was read from
+_current_character_name = None
+_current_character_mtime = None
+
 def set_current_character(name: str):
     """Sets the current character to the given name."""
     with open(current_character_file_path, "w") as fp:
         fp.write(name)
 
 def get_current_character_name() -> str:
-    """Returns the name of the current character."""
-    with open(current_character_file_path, "r") as fp:
-        return fp.read()
+    """Returns the name of the current character. The file is only read again if it was modified since the last read."""
+    global _current_character_name, _current_character_mtime
+    mtime = path.getmtime(current_character_file_path)
+    if mtime != _current_character_mtime:
+        profiling.count("file reads")
+        with open(current_character_file_path, "r") as fp:
+            _current_character_name = fp.read()
+        _current_character_mtime = mtime
+    return _current_character_name
 
 def get_current_character_roll(macro: str) -> str:
     """Loads the current character and makes a roll. Returns none if invalid."""
     return get_character_roll(get_current_character_name(), macro)
 
+class Resolver:
+    """Resolves macros of the current character for the length of a session (e.g. a single command).
+    The current character is looked up once, on first use, rather than for every macro."""
+    def __init__(self):
+        self._character = None
+        self._looked_up = False
+    
+    @property
+    def character(self) -> Character:
+        """The current character, or None if there is none."""
+        if not self._looked_up:
+            if path.exists(current_character_file_path):
+                self._character = get_character(get_current_character_name())
+            self._looked_up = True
+        return self._character
+    
+    def get_roll(self, macro: str) -> str:
+        """Returns what the macro expands into for the current character, or None if it is not one of its macros."""
+        return self.character.get_roll(macro) if self.character else None
+
 # Character creation and saving
 
 def save_character(character: Character):
-    """Saves a character so it can be loaded in the future."""
-    characters[character.name] = character
-    save_characters(characters)
+    """Saves a character, including its macros, so it can be loaded in the future."""
+    with _connect() as db:
+        _save_character_row(db, character)
+        db.execute("DELETE FROM character_macros WHERE character = ?", (character.name,))
+        db.executemany("INSERT INTO character_macros VALUES (?, ?, ?)", [(character.name, macro, value) for macro, value in character.macros.items()])
+    _loaded[character.name] = character
+    _changed()
+
+def get_existing_character(name: str) -> Character:
+    """Returns the character with the given name, raising a ParseException if there is no such character."""
+    if character := get_character(name):
+        return character
+    raise ParseException("Failure: no character is named '{}'".format(name))
 
 def make_character(name: str = None):
     """Makes a new character based on user input. Saves it upon completion."""
@@ -181,25 +306,32 @@ def make_character(name: str = None):
 
 def delete_character(name: str):
     """Deletes a character from file."""
-    del characters[name]
-    save_characters(characters)
+    get_existing_character(name)
+    with _connect() as db:
+        db.execute("DELETE FROM characters WHERE name = ?", (name,))
+        db.execute("DELETE FROM character_macros WHERE character = ?", (name,))
+    _loaded.pop(name, None)
+    _changed()
 
 def update_character(name: str):
+    character = get_existing_character(name)
     print("Updating", name)
     attribute = input("Attribute: ")
     newval = input("New value: ")
-    characters[name].update(attribute, newval)
-    save_characters(characters)
+    character.update(attribute, newval)
+    with _connect() as db:
+        _save_character_row(db, character)
+    _changed()
     print("Successfully updated", name)
 
 def rename_character(oldname: str, newname: str = None):
-    if not oldname in characters:
+    if not get_character(oldname):
         print("Failure: no character is named '{}'".format(oldname))
         return
 
     if not newname:
         newname = input("New name for {}: ".format(oldname))
-    if newname in characters:
+    if get_character(newname):
         yes, no = 'y', 'n'
         overwrite = input("'{}' is already a character. Overwrite {}? ({}/{}): ".format(newname, newname, yes, no))
         while overwrite != yes and overwrite != no:
@@ -208,15 +340,24 @@ def rename_character(oldname: str, newname: str = None):
             print("Did not rename {}.".format(oldname))
             return
 
-    characters[newname] = characters.pop(oldname)
+    with _connect() as db:
+        db.execute("DELETE FROM characters WHERE name = ?", (newname,))
+        db.execute("DELETE FROM character_macros WHERE character = ?", (newname,))
+        db.execute("UPDATE characters SET name = ? WHERE name = ?", (newname, oldname))
+        db.execute("UPDATE character_macros SET character = ? WHERE character = ?", (newname, oldname))
+    _loaded.pop(newname, None)
+    if character := _loaded.pop(oldname, None):
+        character.name = newname
+        _loaded[newname] = character
+    _changed()
     if get_current_character_name() == oldname:
         set_current_character(newname)
-    save_characters(characters)
     print("Successfully renamed {} to {}".format(oldname, newname))
 
 
 def make_character_macro(name: str, macro: str = None, value: str = None):
     """Makes or remakes a macro for the specified character. If no macro is provided, the user is asked. If value is provided, so too must macro."""
+    character = get_existing_character(name)
     if macro:
         print("Making macro '{}' for {}".format(macro, name))
     else:
@@ -225,20 +366,25 @@ def make_character_macro(name: str, macro: str = None, value: str = None):
     assert_valid_macro(macro)
     if not value:
         value = input("Value: ")
-    characters[name].add_macro(macro, value)
-    save_characters(characters)
+    character.add_macro(macro, value)
+    with _connect() as db:
+        db.execute("INSERT OR REPLACE INTO character_macros VALUES (?, ?, ?)", (name, macro, value))
+    _changed()
     print("Successfully added macro '{}' with value '{}' to {}".format(macro, value, name))
 
 def delete_character_macro(name: str, macro: str = None):
     """Deletes a macro from the specified character. If no macro is provided, the user is asked."""
+    character = get_existing_character(name)
     if macro:
         print("Deleting macro '{}' from {}".format(macro, name))
     else:
         macro = input('Macro to delete from {}:'.format(name))
 
     try:
-        characters[name].delete_macro(macro)
-        save_characters(characters)
+        character.delete_macro(macro)
+        with _connect() as db:
+            db.execute("DELETE FROM character_macros WHERE character = ? AND macro = ?", (name, macro))
+        _changed()
         print("Successfully deleted macro '{}' from {}".format(macro, name))
     except KeyError:
-        raise ParseException("Failure: {} does not have the macro '{}'".format(name, macro))
\ No newline at end of file
+        raise ParseException("Failure: {} does not have the macro '{}'".format(name, macro))
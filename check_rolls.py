@@ -0,0 +1,27 @@
+import sys
+import dicerng
+from group import Group
+from roll import Roll
+
+# Checks that rolls total what they should however they are executed, e.g. that a roll with no dice totals only its bonus.
+# Usage: python check_rolls.py
+
+def no_dice_failures() -> list:
+    """Returns a description of each way of rolling no dice that totals more than the bonus."""
+    rng = dicerng.DiceRNG(0)
+    rng.roll(6) # fills the buffer of d6, which rolling no dice must leave alone
+    failures = []
+    roll = Roll("0d6+3")
+    for method, total in [("run", roll.run(rng).total), ("execute", roll.execute(False, rng)), ("evaluate", roll.evaluate(rng))]:
+        if total != 3:
+            failures.append("Roll('0d6+3').{} totalled {}".format(method, total))
+    for args in [["_d6", "=0"], ["0d6+3", "-sim", "100"]]:
+        value = Group(list(args), rng=rng).run(rng).value
+        if value != (0 if args[0] == "_d6" else 3):
+            failures.append("{} yielded {}".format(" ".join(args), value))
+    return failures
+
+if __name__ == "__main__":
+    failures = no_dice_failures()
+    print("Rolls of no dice: {}".format("; ".join(failures) or "ok"))
+    raise SystemExit(1 if failures else 0)
@@ -0,0 +1,41 @@
+import re
+import subprocess
+import sys
+from util import PATH_TO_DIR
+
+# Checks that rolling stays quick to start: importing main must fit in the import time budget (measured with
+# `python -X importtime`), and a plain roll must not load the character or macro stores.
+# Usage: python check_startup.py [budget in milliseconds]
+
+DEFAULT_BUDGET_MS = 60
+
+_importtime_regex = re.compile(r"^import time:\s*(?P<self>\d+) \|\s*(?P<cumulative>\d+) \| (?P<indent>\s*)(?P<module>\S+)$")
+
+def measure_import_ms(module: str = "main") -> float:
+    """Returns the cumulative time in milliseconds to import the module in a fresh interpreter, as reported by -X importtime."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module], cwd=PATH_TO_DIR, capture_output=True, text=True)
+    for line in proc.stderr.splitlines():
+        if (match := _importtime_regex.match(line)) and match.group("module") == module and not match.group("indent"):
+            return int(match.group("cumulative")) / 1000
+    raise RuntimeError("Unable to measure import of {}:\n{}".format(module, proc.stderr))
+
+def stores_loaded_by(args: list) -> list:
+    """Runs main on the given args in a fresh interpreter. Returns the names of the stores that were loaded."""
+    code = "import main, character, macros; main.main({!r}); print(character._connection is not None, macros._macros is not None)".format(args)
+    proc = subprocess.run([sys.executable, "-c", code], cwd=PATH_TO_DIR, capture_output=True, text=True)
+    characters_loaded, macros_loaded = proc.stdout.split()[-2:]
+    return [store for store, loaded in [("characters", characters_loaded), ("macros", macros_loaded)] if loaded == "True"]
+
+if __name__ == "__main__":
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+    ok = True
+
+    import_ms = min(measure_import_ms() for _ in range(5))
+    print("Importing main: {:.1f} ms (budget {:.0f} ms)".format(import_ms, budget))
+    ok = ok and import_ms <= budget
+
+    loaded = stores_loaded_by(["1d20"])
+    print("Stores loaded by '1d20': {}".format(", ".join(loaded) or "none"))
+    ok = ok and not loaded
+
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,32 @@
+import json
+import os
+import socket
+import sys
+from util import SOCKET_PATH
+
+# A thin client for server.py, which falls back to rolling in this process if the server is not running.
+
+def send(args: list, socket_path: str = SOCKET_PATH) -> bool:
+    """Sends args to the server and streams its output to stdout. Returns False if the server could not be reached."""
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+    except OSError:
+        return False
+    with sock:
+        sock.sendall((json.dumps(args) + "\n").encode())
+        while chunk := sock.recv(4096):
+            sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+    return True
+
+def resolve_paths(args: list) -> list:
+    """Returns the args with the path of any '--detail=' option made absolute, since the server has its own working directory."""
+    return ["--detail=" + os.path.abspath(arg[len("--detail="):]) if arg.startswith("--detail=") else arg for arg in args]
+
+if __name__ == "__main__":
+    args = resolve_paths(sys.argv[1:])
+    # commands may prompt for input, and batches read files or stdin, so they are run here
+    if not args or args[0] == "!" or "--batch" in args or not send(args):
+        import main
+        main.main(args)
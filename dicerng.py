@@ -0,0 +1,116 @@
+import random
+from collections import Counter
+from functools import lru_cache
+
+# the number of dice drawn at once for each kind of die
+buffer_size = 256
+
+# the most dice drawn at once when only how many land on each face is needed
+count_chunk_size = 1 << 20
+# pools of more dice than this are counted in a single multinomial draw, if numpy is available
+multinomial_threshold = 1 << 24
+
+@lru_cache(maxsize=None)
+def _face_table(faces: int) -> bytes:
+    # maps each random byte, for bytes.translate(), to the face it rolls less 1, or to 255 if it is rejected
+    mask = (1 << (faces - 1).bit_length()) - 1
+    return bytes(value & mask if value & mask < faces else 255 for value in range(256))
+
+class DiceRNG:
+    """Rolls dice using a random.Random, which can be seeded so that every roll is reproducible.\n
+    Dice are drawn in bulk, from random bytes in place of a call to randint per die. Each byte is masked down to
+    the fewest bits that can hold the faces and rejected if too large, so every face is equally likely.
+    Each kind of die keeps a buffer of such draws, so single dice are cheap too."""
+    __slots__ = ("random", "buffers")
+
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
+        self.buffers = {}
+
+    def seed(self, seed):
+        """Reseeds the generator, discarding any buffered dice."""
+        self.random.seed(seed)
+        self.buffers.clear()
+
+    def getrandbits(self, k: int) -> int:
+        return self.random.getrandbits(k)
+
+    def roll(self, faces: int) -> int:
+        """Returns the number on a single die with the given number of faces (at least 1)."""
+        try:
+            return self.buffers[faces].pop()
+        except (KeyError, IndexError): # no buffer yet, or it is empty
+            buffer = self.buffers[faces] = self.draw(faces, buffer_size)
+            return buffer.pop()
+
+    def dice(self, faces: int, n: int) -> list:
+        """Returns a new list of the numbers on n dice with the given number of faces (at least 1)."""
+        if n <= 0:
+            return [] # buffer[-0:] would be the whole buffer
+        if n == 1:
+            return [self.roll(faces)]
+        if n > buffer_size:
+            return self.draw(faces, n)
+        buffer = self.buffers.get(faces)
+        if not buffer or len(buffer) < n:
+            buffer = self.buffers[faces] = self.draw(faces, buffer_size) + (buffer or [])
+        out = buffer[-n:]
+        del buffer[-n:]
+        return out
+
+    def counts(self, faces: int, n: int) -> list:
+        """Returns how many of n dice with the given number of faces (at least 1) land on each face, as a list from face 1 up.\n
+        The dice are drawn as random bytes, in chunks, and counted with bytes.count(), so this takes memory in proportion
+        to the faces rather than to n. Pools of more than multinomial_threshold dice are instead counted in a single
+        multinomial draw if numpy is available, in time in proportion to the faces; such pools then depend on whether it is."""
+        if n > multinomial_threshold:
+            try:
+                import numpy as np # imported here since it is slow to import and rarely needed
+            except ImportError:
+                np = None
+            if np is not None:
+                return np.random.default_rng(self.getrandbits(128)).multinomial(n, [1 / faces] * faces).tolist()
+
+        counts = [0] * faces
+        remaining = n
+        if faces > 256:
+            while remaining:
+                chunk = min(remaining, count_chunk_size)
+                for value, count in Counter(self.draw(faces, chunk)).items():
+                    counts[value - 1] += count
+                remaining -= chunk
+            return counts
+
+        table = _face_table(faces)
+        while remaining:
+            chunk = self.random.randbytes(min(remaining, count_chunk_size)).translate(table)
+            for i in range(faces):
+                count = chunk.count(i)
+                counts[i] += count
+                remaining -= count
+        return counts
+
+    def draw(self, faces: int, n: int) -> list:
+        """Returns n dice with the given number of faces, drawn directly from the generator."""
+        if faces > 256:
+            bits = (faces - 1).bit_length()
+            getrandbits = self.random.getrandbits
+            out = []
+            for _ in range(n):
+                value = getrandbits(bits)
+                while value >= faces:
+                    value = getrandbits(bits)
+                out.append(value + 1)
+            return out
+
+        mask = (1 << (faces - 1).bit_length()) - 1
+        out = []
+        while len(out) < n:
+            needed = n - len(out)
+            # at most half of the bytes are rejected, so this usually takes one pass
+            out += [value + 1 for value in map(mask.__and__, self.random.randbytes(needed + (needed >> 1) + 8)) if value < faces]
+        del out[n:]
+        return out
+
+# used by every roll unless another generator is given
+default = DiceRNG()
@@ -0,0 +1,132 @@
+from contextlib import contextmanager
+from math import comb
+from util import ParseException
+
+# A distribution is a probability mass function: a map from outcome (int) to probability (float).
+
+# the most steps (e.g. pairs of outcomes combined) that finding a distribution within limited() may take
+max_work = 2000000
+
+# the steps left within limited(), or None if unlimited
+_remaining = None
+
+@contextmanager
+def limited(work: int = None):
+    """Limits the distributions found in the body of a with statement to the given number of steps in all (max_work by default).
+    Finding one that would take more raises a ParseException up front, rather than stalling e.g. the server."""
+    global _remaining
+    previous, _remaining = _remaining, max_work if work is None else work
+    try:
+        yield
+    finally:
+        _remaining = previous
+
+def _spend(work: int):
+    """Takes the given number of steps from the limit, if any, raising a ParseException if there are not enough left."""
+    global _remaining
+    if _remaining is not None:
+        _remaining -= work
+        if _remaining < 0:
+            raise ParseException("Failure: too many outcomes to find the chance of exactly; try '-sim' instead")
+
+def constant(val: int) -> dict:
+    """Returns the distribution of something that always has the given value."""
+    return {val: 1.0}
+
+def shift(dist: dict, bonus: int) -> dict:
+    """Returns the distribution with every outcome increased by bonus."""
+    if not bonus:
+        return dist
+    return {outcome + bonus: p for outcome, p in dist.items()}
+
+def convolve(a: dict, b: dict) -> dict:
+    """Returns the distribution of the sum of two independent outcomes."""
+    _spend(len(a) * len(b))
+    result = {}
+    for outa, pa in a.items():
+        for outb, pb in b.items():
+            result[outa + outb] = result.get(outa + outb, 0.0) + pa * pb
+    return result
+
+def convolve_all(dists: list) -> dict:
+    """Returns the distribution of the sum of any number of independent outcomes."""
+    result = constant(0)
+    for dist in dists:
+        result = convolve(result, dist)
+    return result
+
+def repeat(dist: dict, n: int) -> dict:
+    """Returns the distribution of the sum of n independent copies of dist, using repeated squaring."""
+    result = constant(0)
+    while n > 0:
+        if n & 1:
+            result = convolve(result, dist)
+        n >>= 1
+        if n:
+            dist = convolve(dist, dist)
+    return result
+
+def die(faces: int, reroll: int = 0) -> dict:
+    """Returns the distribution of a single die, which is rerolled once if it lands at or below the reroll threshold."""
+    if faces == 0:
+        return constant(0)
+    _spend(faces)
+    rerolled = min(reroll, faces) / faces
+    return {face: (face > reroll) / faces + rerolled / faces for face in range(1, faces + 1)}
+
+def keep(face_dist: dict, count: int, lo: int, hi: int) -> dict:
+    """Returns the distribution of the sum of some of count independent dice with the given face distribution.\n
+    Only the dice at positions lo (inclusive) through hi (exclusive) are kept, once sorted from highest to lowest."""
+    lo, hi = max(lo, 0), min(hi, count)
+    if lo >= hi:
+        return constant(0)
+    if lo == 0 and hi == count:
+        return repeat(face_dist, count)
+
+    faces = sorted(face_dist, reverse=True)
+    # probability that a die lands strictly below each face
+    below = {}
+    remaining = 1.0
+    for face in faces:
+        remaining -= face_dist[face]
+        below[face] = max(remaining, 0.0)
+
+    # assign faces from highest to lowest; states map (dice assigned so far, sum of kept dice) to probability
+    result = {}
+    states = {(0, 0): 1.0}
+    for face in faces:
+        pface = face_dist[face]
+        # each step here takes about ten times as long as combining a pair of outcomes in convolve()
+        _spend(10 * sum(count - assigned + 1 for assigned, _ in states))
+        newstates = {}
+        for (assigned, kept_sum), p in states.items():
+            left = count - assigned
+            for j in range(left + 1):
+                used = assigned + j
+                newp = p * comb(left, j) * pface ** j
+                if newp == 0.0:
+                    continue
+                kept_sum_j = kept_sum + face * max(0, min(used, hi) - max(assigned, lo))
+                if used >= hi:
+                    # the remaining dice are not kept, so they just need to land below this face
+                    newp *= below[face] ** (count - used)
+                    result[kept_sum_j] = result.get(kept_sum_j, 0.0) + newp
+                else:
+                    newstates[(used, kept_sum_j)] = newstates.get((used, kept_sum_j), 0.0) + newp
+        states = newstates
+    return result
+
+def chance(dist: dict, op: str, target: int) -> float:
+    """Returns the probability that an outcome compares to target as specified by op (e.g. '>=')."""
+    compare = {
+        '>=': lambda outcome: outcome >= target,
+        '<=': lambda outcome: outcome <= target,
+        '>': lambda outcome: outcome > target,
+        '<': lambda outcome: outcome < target,
+        '=': lambda outcome: outcome == target,
+    }[op]
+    return sum(p for outcome, p in dist.items() if compare(outcome))
+
+def mean(dist: dict) -> float:
+    """Returns the expected value of the distribution."""
+    return sum(outcome * p for outcome, p in dist.items())
@@ -0,0 +1,95 @@
+import re
+import macros as mac
+import character
+import profiling
+import util
+
+# a list of characters that partition individual arguments
+comma = ','
+left_paren = util.LEFT_PAREN
+right_paren = util.RIGHT_PAREN
+delimiters = [left_paren, right_paren, comma]
+
+_delimiter_regex = re.compile("([{}])".format(re.escape("".join(delimiters))))
+
+def expand_delimiters(arg: str) -> list:
+    """Partitions the given arg into a list of subarguments using the delimiters, which are included in the resulting list."""
+    return [a for a in _delimiter_regex.split(arg) if a] # remove empty strings
+
+def split_macro(macro: str) -> list:
+    """Splits the value of a macro. Identical to str.split(), except for the case where a macro expands into something that contains a space, which this handles properly."""
+    words = macro.split()
+    apos = "'"
+    i = 0
+    while i < len(words):
+        if apos in words[i]:
+            words[i] = words[i].replace(apos, "")
+            while not apos in words[i]:
+                words[i] += " " + words.pop(i+1)
+            words[i] = words[i].replace(apos, "")
+        elif words[i][-1] == "\\":
+            words[i] = words[i][:-1] + " " + words.pop(i+1)
+        i += 1
+    return words
+
+def is_possible_macro(arg: str) -> bool:
+    """Returns whether the arg could be a macro. Args that are already valid (e.g. '1d20' or 'd6') are never looked up,
+    even if a macro has that name, so the stores are only loaded when needed; see macros.is_reserved()."""
+    return mac.is_macro_name(arg) and not mac.is_reserved(arg)
+
+# the full expansion of each macro, which is valid as long as this key is unchanged
+_memo = {}
+_memo_key = None
+
+class Expander:
+    """Expands macros and delimiters in args, for the length of a session (e.g. a single command).
+    The full expansion of each macro is memoized across sessions until a macro or character changes."""
+    def __init__(self, resolver: character.Resolver):
+        self.resolver = resolver
+        self._memo = None
+    
+    def get_memo(self) -> dict:
+        """Returns the memoized expansions, forgetting them first if they are out of date."""
+        global _memo, _memo_key
+        if self._memo is None:
+            current = self.resolver.character
+            key = (mac.version, character.version, current.name if current else None)
+            if key != _memo_key:
+                _memo, _memo_key = {}, key
+            self._memo = _memo
+        return self._memo
+    
+    def lookup(self, arg: str) -> str:
+        """Returns the value of the macro, or None if it is not a macro. Character macros take precedence."""
+        profiling.count("macro lookups")
+        return self.resolver.get_roll(arg) or mac.macros.get(arg)
+    
+    def expand_arg(self, arg: str, expanding: list) -> list:
+        """Returns the list of args that the arg fully expands into.\n
+        expanding: the macros currently being expanded, used to detect macros that expand into themselves"""
+        if not is_possible_macro(arg):
+            parts = expand_delimiters(arg)
+            if parts == [arg]:
+                return parts
+            return [expanded for part in parts for expanded in self.expand_arg(part, expanding)]
+
+        memo = self.get_memo()
+        if arg in memo:
+            return memo[arg]
+        if arg in expanding:
+            raise util.ParseException("Failure: macro '{}' expands into itself ({})".format(arg, " -> ".join(expanding + [arg])))
+
+        value = self.lookup(arg)
+        words = split_macro(value) if value else [arg]
+        if words == [arg]:
+            result = words
+        else:
+            expanding.append(arg)
+            result = [expanded for word in words for expanded in self.expand_arg(word, expanding)]
+            expanding.pop()
+        memo[arg] = result
+        return result
+    
+    def expand(self, args: list) -> list:
+        """Returns a new list in which every macro and delimiter in args is expanded."""
+        return [expanded for arg in args for expanded in self.expand_arg(arg, [])]
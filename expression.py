@@ -1,48 +1,204 @@
 import util
 import re
+from fractions import Fraction
+from functools import lru_cache
+import distribution
+import render
+import profiling
+from result import ExpressionResult
 
-_expression_regex = re.compile(r"(?P<label>\w*)=(?P<expr>[\d\.\*\+-/]+)$")
-
-def is_expression(arg: str) -> bool:
-    """Determines if the given string is an expression."""
-    return _expression_regex.match(arg)
-
-def parse_math(arg: str) -> float:
-    """A basic parser for math. Evaluates a string like '3+2.5*-2' to be -11.0. Returns a float."""
-    if match := _expression_regex.match(arg):
-        arg = match.group('expr')
-    else:
-        raise util.ParseException("Failure: '{}' is not an expression.".format(arg))
-
-    result = 0.0
-    nextop = result.__add__
-    num = ''
-    # just do them in order, no PEMDAS
-    for c in arg:
-        if ('0' <= c and c <= '9') or c == '.':
-            num += c
-        elif not num and c == '-':
-            num = '-'
+_expression_regex = re.compile(r"(?P<label>\w*)=(?P<expr>[\d\.\*\+\-/()_]+)$")
+_token_regex = re.compile(r"(?P<num>\d+(?:\.\d*)?|\.\d+)|(?P<blank>_)|(?P<op>[-+*/()])")
+
+# Values are exact rationals, kept as pairs (numerator, denominator) of ints with a positive denominator,
+# which is much faster than Fraction. Pairs are only reduced when converted back to a number.
+
+def _rational(value) -> tuple:
+    """Returns the given int, float, Fraction, or numeric string (e.g. from a table) as a pair (numerator, denominator)."""
+    if isinstance(value, int):
+        return value, 1
+    try:
+        value = Fraction(value)
+    except (ValueError, TypeError):
+        raise util.ParseException("Failure: '{}' is not a number".format(value))
+    return value.numerator, value.denominator
+
+def _truncate(pair: tuple) -> int:
+    """Returns the given pair rounded toward zero, as int() does."""
+    n, d = pair
+    return n // d if n >= 0 else -(-n // d)
+
+def _add(a, b):
+    return a[0] * b[1] + b[0] * a[1], a[1] * b[1]
+
+def _subtract(a, b):
+    return a[0] * b[1] - b[0] * a[1], a[1] * b[1]
+
+def _multiply(a, b):
+    return a[0] * b[0], a[1] * b[1]
+
+def _divide(a, b):
+    if b[0] == 0:
+        raise util.ParseException("Failure: division by zero in expression.")
+    if b[0] < 0:
+        return -a[0] * b[1], a[1] * -b[0]
+    return a[0] * b[1], a[1] * b[0]
+
+_operators = {'+': _add, '-': _subtract, '*': _multiply, '/': _divide}
+
+# instructions of a compiled expression, which is run on a stack
+_PUSH = "push" # push the constant
+_BLANK = "blank" # push the value filled in for the blank with the given index
+_NEG = "neg" # negate the top of the stack
+
+class _Compiler:
+    """Compiles the tokens of an expression into a list of instructions in postfix order, by recursive descent.
+    Parts that do not depend on blanks are calculated as they are compiled."""
+    def __init__(self, expr: str):
+        self.tokens = []
+        pos = 0
+        while pos < len(expr):
+            if not (match := _token_regex.match(expr, pos)):
+                raise util.ParseException("Failure: unexpected '{}' in expression '{}'".format(expr[pos], expr))
+            self.tokens.append((match.lastgroup, match.group()))
+            pos = match.end()
+        self.i = 0
+        self.blanks = 0
+
+    def peek(self) -> str:
+        return self.tokens[self.i][1] if self.i < len(self.tokens) else None
+
+    def compile(self) -> tuple:
+        program = self.sum()
+        if self.i < len(self.tokens):
+            raise util.ParseException("Failure: unexpected '{}' in expression".format(self.peek()))
+        return tuple(program)
+
+    def binary(self, left: list, op: str, right: list) -> list:
+        if len(left) == 1 == len(right) and left[0][0] == _PUSH == right[0][0]:
+            return [(_PUSH, _operators[op](left[0][1], right[0][1]))]
+        return left + right + [(op, _operators[op])]
+
+    def sum(self) -> list:
+        """sum := product (('+' | '-') product)*"""
+        program = self.product()
+        while self.peek() in ('+', '-'):
+            op = self.tokens[self.i][1]
+            self.i += 1
+            program = self.binary(program, op, self.product())
+        return program
+
+    def product(self) -> list:
+        """product := unary (('*' | '/') unary)*"""
+        program = self.unary()
+        while self.peek() in ('*', '/'):
+            op = self.tokens[self.i][1]
+            self.i += 1
+            program = self.binary(program, op, self.unary())
+        return program
+
+    def unary(self) -> list:
+        """unary := '-' unary | atom"""
+        if self.peek() == '-':
+            self.i += 1
+            program = self.unary()
+            if len(program) == 1 and program[0][0] == _PUSH:
+                n, d = program[0][1]
+                return [(_PUSH, (-n, d))]
+            return program + [(_NEG, None)]
+        return self.atom()
+
+    def atom(self) -> list:
+        """atom := number | '_' | '(' sum ')'"""
+        if self.i >= len(self.tokens):
+            raise util.ParseException("Failure: expression ends unexpectedly")
+        kind, token = self.tokens[self.i]
+        self.i += 1
+        if kind == "num":
+            return [(_PUSH, _rational(Fraction(token)) if '.' in token else (int(token), 1))]
+        if kind == "blank":
+            self.blanks += 1
+            return [(_BLANK, self.blanks - 1)]
+        if token == '(':
+            program = self.sum()
+            if self.peek() != ')':
+                raise util.ParseException("Failure: missing ')' in expression")
+            self.i += 1
+            return program
+        raise util.ParseException("Failure: unexpected '{}' in expression".format(token))
+
+@lru_cache(maxsize=1024)
+def compile_expression(arg: str) -> (str, tuple):
+    """Compiles an expression like 'dmg=_+1/6+1', in which each _ is a blank to be filled in when it is evaluated.
+    Returns a tuple (label, program). Compiled expressions are cached by arg."""
+    profiling.count("regex matches") # only counted when the arg is not cached
+    if not (match := _expression_regex.match(arg)):
+        raise util.ParseException("Failure: cannot parse '{}' as expression.".format(arg))
+    return match.group('label'), _Compiler(match.group('expr')).compile()
+
+def _run(program: tuple, blanks: tuple) -> tuple:
+    """Runs a compiled expression, filling in its blanks with the given values in order. Returns the outcome as a pair."""
+    stack = []
+    for op, arg in program:
+        if op == _PUSH:
+            stack.append(arg)
+        elif op == _BLANK:
+            if arg >= len(blanks):
+                raise util.ParseException("Failure: missing value for _ in expression")
+            stack.append(_rational(blanks[arg]))
+        elif op == _NEG:
+            n, d = stack[-1]
+            stack[-1] = (-n, d)
         else:
-            result = nextop(float(num))
-            num = ''
-            nextop = {'+':result.__add__, '-':result.__sub__, '*':result.__mul__, '/':result.__truediv__}[c]
-    result = nextop(float(num))
-    return result
+            right = stack.pop()
+            stack[-1] = arg(stack[-1], right)
+    return stack[0]
 
 class Expression:
-    def __init__(self, arg: str):
-        if match := _expression_regex.match(arg):
-            self.label = match.group('label')
-            self.value = int(parse_math(arg))
-        else:
-            raise util.ParseException("Failure: cannot parse '{}' as expression.".format(arg))
+    def __init__(self, arg: str, blanks: tuple = ()):
+        """arg: an expression, e.g. 'dmg=2*(3+1)'\n
+        blanks: the values that fill in each _ in arg, in order"""
+        self.label, program = compile_expression(arg)
+        self.value = _truncate(_run(program, blanks))
     
-    def execute(self, print_output: bool = False) -> int:
+    # rng is unused, but accepted so that every kind of item can be run alike
+    def run(self, rng=None) -> ExpressionResult:
+        return ExpressionResult(self.label, self.value)
+    
+    def execute(self, print_output: bool = False, rng=None) -> int:
         if print_output:
-            print("{} = {}".format(self.label, self.value))
+            print(render.text(self.run()))
+        return self.value
+    
+    def evaluate(self, rng=None) -> int:
         return self.value
+    
+    def distribution(self) -> dict:
+        return distribution.constant(self.value)
 
 def get_expression(val: int, label: str = "") -> str:
     """Returns a valid expression string (with optional label) that evaluates to the given val."""
-    return label + "=" + str(val)
\ No newline at end of file
+    return label + "=" + str(val)
+# Before precedence, expressions were evaluated strictly from left to right, e.g. '=_+1/6+1' meant '=((_+1)/6)+1'.
+_left_to_right_operand = r"-?(?:\d+(?:\.\d*)?|\.\d+|_)"
+_left_to_right_regex = re.compile(r"(?P<first>{0})(?P<rest>(?:[-+*/]{0})*)".format(_left_to_right_operand))
+_left_to_right_step_regex = re.compile(r"(?P<op>[-+*/])(?P<operand>{})".format(_left_to_right_operand))
+
+def left_to_right(arg: str) -> str:
+    """Returns the expression with the parentheses it needs to mean what it did when expressions were evaluated strictly
+    from left to right, e.g. 'dmg=_+1/6+1' becomes 'dmg=(_+1)/6+1'. Anything else, including expressions that
+    already have parentheses, is returned as it is."""
+    if not (match := _expression_regex.match(arg)) or not (expr := _left_to_right_regex.fullmatch(match.group("expr"))):
+        return arg
+    out, additive = expr.group("first"), False
+    for step in _left_to_right_step_regex.finditer(expr.group("rest")):
+        op = step.group("op")
+        if op in "*/" and additive:
+            out, additive = "(" + out + ")", False
+        out += op + step.group("operand")
+        additive = additive or op in "+-"
+    return match.group("label") + "=" + out
+
+def left_to_right_args(value: str) -> str:
+    """Returns the value of a macro with left_to_right() applied to each of its args."""
+    return " ".join(left_to_right(arg) for arg in value.split(" "))
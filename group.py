@@ -1,96 +1,193 @@
-import re
+import itertools
+import math
+import os
+import random
 from roll import Roll
+import dicerng
 import util
+import lexer
 import tags
 import modifier
 import expression
 import table
+import distribution
+import statistic
+import render
+import profiling
+from result import GroupResult, TableResult
 
-multiplier_regex = re.compile(r"^x(\d+)$")
 left_sep = util.LEFT_PAREN
 right_sep = util.RIGHT_PAREN
 blank = '_'
 
-def evaluate_blank(args: list, i: int) -> str:
-    while blank in args[i]:
-        if i+1 == len(args):
-            raise util.ParseException("Failure: missing value for _ in '{}'".format(args[i]))
-
-        if blank in args[i+1]:
-            # parse that blank first
-            evaluate_blank(args, i+1)
-
-        # replace blanks with next value after executed
-        if args[i+1] == left_sep:
-            # if the next arg is the beginning of a group, parse and execute the group
-            depth = 0
-            j = i+1
-            while depth >= 0:
-                j += 1
-                depth += 1 if args[j] == left_sep else (-1 if args[j] == right_sep else 0)
-            nextvalue = str(Group(args[i+2:j]).execute(print_rolls=False))
-            del args[i+1:j+1]
-        elif expression.is_expression(args[i+1]):
-            # if the arg is an expression, evaluate it
-            nextvalue = str(int(expression.parse_math(args[i+1])))
-            del args[i+1]
-        elif table.is_table(args[i+1]):
-            nextvalue = table.Table(args[i+1]).execute()
-            del args[i+1]
-        else:
-            # try to parse next arg as a roll
-            nextvalue = str(Roll(args[i+1]).execute(print_output=False))
+def take_blank_value(args: list, i: int, rng: dicerng.DiceRNG = None):
+    """Parses the item that fills in the next blank of args[i], and removes it from args.
+    Returns the item, which has an evaluate() method. Any blanks that are filled in right away are rolled with rng."""
+    if i+1 == len(args):
+        raise util.ParseException("Failure: missing value for _ in '{}'".format(args[i]))
+
+    if blank in args[i+1]:
+        # parse that blank first
+        if Blank.can_defer(args[i+1]):
+            value = Blank(args, i+1, rng)
             del args[i+1]
+            return value
+        evaluate_blank(args, i+1, rng)
 
-        # replace blank with resulting value
+    kind, value = lexer.lex(args[i+1])
+    if kind == lexer.LEFT:
+        # if the next arg is the beginning of a group, parse the group
+        depth = 0
+        j = i+1
+        while depth >= 0:
+            j += 1
+            if j >= len(args):
+                raise util.ParseException("Unable to parse group from '{}' due to missing '{}'".format(" ".join(args[i+1:]), right_sep))
+            depth += 1 if args[j] == left_sep else (-1 if args[j] == right_sep else 0)
+        value = Group(args[i+2:j], rng=rng)
+        del args[i+1:j+1]
+        return value
+    elif kind == lexer.EXPRESSION:
+        value = expression.Expression(args[i+1])
+    elif kind == lexer.TABLE:
+        value = table.Table(args[i+1])
+    elif kind == lexer.RANDOM_TABLE:
+        value = table.load_table(value)
+    else:
+        # try to parse next arg as a roll
+        value = Roll(args[i+1])
+    del args[i+1]
+    return value
+
+def evaluate_blank(args: list, i: int, rng: dicerng.DiceRNG = None):
+    """Replaces each blank in args[i] with the outcome of the item after it, which is removed from args."""
+    while blank in args[i]:
+        profiling.count("blanks filled at parse")
+        nextvalue = str(take_blank_value(args, i, rng).evaluate(rng))
         args[i] = args[i].replace(blank, nextvalue, 1)
 
+class Blank:
+    """A roll or expression containing blanks, which are filled in by the outcomes of the items after it each time it is executed."""
+    def __init__(self, args: list, i: int, rng: dicerng.DiceRNG = None):
+        """Parses args[i] and the items that fill in its blanks, which are removed from args."""
+        self.template = args[i]
+        self.values = [take_blank_value(args, i, rng) for _ in range(self.template.count(blank))]
+        self.modifiers = []
+        # expressions are compiled once with their blanks, rather than filled in and parsed again each time
+        self.is_expression = lexer.lex(self.template.replace(blank, "1"))[0] == lexer.EXPRESSION
+    
+    @staticmethod
+    def can_defer(arg: str) -> bool:
+        """Returns whether the given arg would be a roll or expression once its blanks are filled in."""
+        kind, _ = lexer.lex(arg.replace(blank, "1"))
+        return kind == lexer.ROLL or kind == lexer.EXPRESSION
+    
+    def resolve(self, outcomes: list = None, rng: dicerng.DiceRNG = None):
+        """Fills in the blanks with the given outcomes, or with outcomes newly evaluated with rng if none are given.
+        Returns the resulting roll or expression."""
+        if outcomes is None:
+            outcomes = [value.evaluate(rng) for value in self.values]
+        if self.is_expression:
+            return expression.Expression(self.template, outcomes)
+        arg = self.template
+        for outcome in outcomes:
+            arg = arg.replace(blank, str(outcome), 1)
+        item = Roll(arg)
+        for mod in self.modifiers:
+            item = modifier.modify(item, mod)
+        return item
+    
+    def run(self, rng: dicerng.DiceRNG = None):
+        return self.resolve(rng=rng).run(rng)
+    
+    def execute(self, print_output: bool = True, rng: dicerng.DiceRNG = None) -> int:
+        return self.resolve(rng=rng).execute(print_output, rng=rng)
+    
+    def evaluate(self, rng: dicerng.DiceRNG = None) -> int:
+        return self.resolve(rng=rng).evaluate(rng)
+    
+    def distribution(self) -> dict:
+        """Returns the exact probability distribution of the outcome, weighting each way of filling in the blanks by its probability."""
+        result = {}
+        for filled in itertools.product(*[value.distribution().items() for value in self.values]):
+            p = math.prod([p for _, p in filled])
+            for outcome, q in self.resolve([outcome for outcome, _ in filled]).distribution().items():
+                result[outcome] = result.get(outcome, 0.0) + p * q
+        return result
+
+# the number of trials in each independently seeded chunk of a simulation; changing it changes the outcome for a given seed
+sim_chunk_trials = 4096
+
+def _simulate(group, rng: dicerng.DiceRNG, trials: int, keep_counts: bool) -> statistic.Accumulator:
+    """Evaluates a group with the given generator for a number of trials. Returns an accumulator of the outcomes."""
+    acc = statistic.Accumulator(keep_counts=keep_counts)
+    evaluate, add = group.evaluate, acc.add
+    for _ in range(trials):
+        add(evaluate(rng))
+    return acc
+
+def _simulate_chunk(job: tuple) -> statistic.Accumulator:
+    """Simulates a chunk of trials with a newly seeded generator.
+    Takes a single tuple (group, seed, trials, keep_counts) so that it can be mapped over by worker processes."""
+    group, seed, trials, keep_counts = job
+    return _simulate(group, dicerng.DiceRNG(seed), trials, keep_counts)
+
 class Group(list):
 
-    def __init__(self, args, depth=0):
+    def __init__(self, args, depth=0, rng: dicerng.DiceRNG = None):
+        """Parses the given args, e.g. ["1d20", "1d4", "-mean"]. Blanks that cannot wait until execution are rolled with rng."""
         if len(args) == 0:
             raise util.ParseException("Failure: unable to parse empty group.")
         self.depth = depth
 
-        self.all_tags = {t:None for t in tags.all_tag_strs}
+        found = {} # map from each tag found to its value, as returned by tags.parse_tag()
         self.askedForStat = False
 
         i = 0
         firstStatFound = None
         while i < len(args):
-            evaluate_blank(args, i)
+            # blanks in rolls and expressions are filled in anew each time the group is executed
+            if blank in args[i] and Blank.can_defer(args[i]):
+                self.append(Blank(args, i, rng))
+                i += 1
+                continue
+            evaluate_blank(args, i, rng)
 
             arg = args[i]
+            kind, value = lexer.lex(arg)
 
             # handle empty arg
-            if not arg:
+            if kind == lexer.EMPTY:
                 pass
 
             # handle tags
-            elif tag := tags.get_tag(arg, args[i+1:]):
-                self.all_tags[arg] = tag
+            elif kind == lexer.TAG:
+                tag, tagvalue = tags.parse_tag(arg, args[i+1:])
+                found[tag] = tagvalue
                 if arg in tags.stat_tag_strs:
                     firstStatFound = firstStatFound or arg
                     self.askedForStat = True
                 if arg in tags.supertag_strs:
                     args.insert(i+1, arg[1:])
+                if arg in tags.numbered_tag_strs:
+                    i += 1 # skip the number, e.g. the number of trials
             
             # handle modifiers
-            elif modifier.is_modifier(arg):
+            elif kind == lexer.MODIFIER:
                 if self: # if there is anything to modify
-                    modifier.modify(self[-1], arg)
+                    self[-1] = modifier.modify(self[-1], arg)
                 else:
                     raise util.ParseException("Error: modifier '{}' requires something to modify.".format(arg))
 
             # handle multipliers
-            elif multiplier_match := multiplier_regex.search(arg):
+            elif kind == lexer.MULTIPLIER:
                 if self: # if there is anything to modify
-                    self[-1:] = [self[-1]] * int(multiplier_match.group(1))
+                    self[-1:] = [self[-1]] * value
                 else:
                     raise util.ParseException("Error: multiplier '{}' requires something to multiply.".format(arg))
             
             # handle separators for grouping
-            elif arg == left_sep:
+            elif kind == lexer.LEFT:
                 depth = 1 # relative depth
                 j = i
                 while depth > 0:
@@ -102,17 +199,21 @@ class Group(list):
                         depth -= 1
                     elif args[j] == left_sep:
                         depth += 1
-                self.append(Group(args[i+1:j], self.depth + 1))
+                self.append(Group(args[i+1:j], self.depth + 1, rng))
                 i = j
             
             # check if it is an expression
-            elif expression.is_expression(arg):
+            elif kind == lexer.EXPRESSION:
                 self.append(expression.Expression(arg))
             
             # check if it is a table
-            elif table.is_table(arg):
+            elif kind == lexer.TABLE:
                 self.append(table.Table(arg))
 
+            # check if it is a random table from a file
+            elif kind == lexer.RANDOM_TABLE:
+                self.append(table.load_table(value))
+
             # assume it is a normal roll
             else:
                 self.append(Roll(arg))
@@ -120,66 +221,126 @@ class Group(list):
             # last line of code in the loop
             i += 1
         
-        if not self.all_tags[tags.YIELD]:
-            self.__set_yield(firstStatFound or tags.TOTAL)
+        sim_stats = ()
+        if tags.SIM in found:
+            # stats describe the outcomes of the simulation, not the outcomes of each trial
+            sim_stats = tuple(stat for stat in tags.stat_tag_strs if stat in found) or tags.default_sim_stat_strs
+            for stat in tags.stat_tag_strs:
+                found.pop(stat, None)
+            firstStatFound = None
 
-        self.__apply_supertags(self.all_tags)
-    
-    def __set_yield(self, stat: str):
-        """Determines what the group returns upon execution"""
-        self.all_tags[tags.YIELD] = tags.Tag(tags.YIELD, contents=stat)
-        self.all_tags[stat] = tags.get_tag(stat, [])
+        # determine what the group returns upon execution
+        if tags.YIELD not in found:
+            found[tags.YIELD] = firstStatFound or tags.TOTAL
+            found[found[tags.YIELD]] = True
+
+        self.tags = tags.TagSet.of(found, sim_stats)
+        if self.tags.flags & tags.supertag_bits:
+            self.__apply_supertags(self.tags)
     
-    def __apply_supertags(self, _tags:list):
-        """Applies corresponding tag of each supertag to this group and all its descendents."""
-        for sts in tags.supertag_strs:
-            st = _tags[sts]
-            if st:
-                nsts = sts[1:]
-                self.all_tags[nsts] = _tags[nsts].clone()
-                if nsts == tags.YIELD:
-                    self.all_tags[_tags[tags.YIELD].value()] = _tags[_tags[tags.YIELD].value()].clone()
-                
-        for item in self:
-            if isinstance(item, Group):
-                item.__apply_supertags(_tags)
+    def __apply_supertags(self, parent_tags: tags.TagSet):
+        """Applies corresponding tag of each of the given supertags to all descendents of this group."""
+        # a multiplied group appears many times but is one object, so it only needs to be visited once
+        for item in {id(item): item for item in self if isinstance(item, Group)}.values():
+            item.tags = item.tags.inherit(parent_tags)
+            item.__apply_supertags(parent_tags)
     
-    def __align_next_print(self):
-        """Prints a number of spaces proportional to depth, but no newline, so that the next call to print() is aligned."""
-        print("  " * self.depth, end = '')
+    def distribution(self) -> dict:
+        """Returns the exact probability distribution of what this group yields, as a map from outcome to probability."""
+        if self.tags.yield_stat != tags.TOTAL:
+            raise util.ParseException("Failure: probabilities can only be found for groups that yield '{}'".format(tags.TOTAL))
+        return distribution.convolve_all([item.distribution() for item in self if not isinstance(item, table.table_types)])
 
-    def execute(self, print_rolls: bool=True) -> int:
-        """Executes every member (group or roll) in this group and prints according to tags.
-        Returns the sum of the outcomes of each member by default."""
+    def evaluate(self, rng: dicerng.DiceRNG = None):
+        """Executes every member of this group with the given generator without printing anything. Returns what the group yields.
+        This is run once per trial of a simulation, so nothing is formatted, and the default total is summed directly."""
+        outcomes = [item.evaluate(rng) for item in self if not isinstance(item, table.table_types)]
+        stat = self.tags.yield_stat
+        if stat == tags.TOTAL:
+            return sum(outcomes)
+        return tags.formulae[stat](statistic.Accumulator(outcomes, keep_counts=stat in tags.count_stat_strs))
 
-        outcomes = []
-        print_rolls = self.all_tags[tags.VERBOSE] or (not self.askedForStat and (len(self) == 1 or self.depth == 0))
-        print_stats = not (self.all_tags[tags.HIDE] or len(self) == 1)
-        lastitemwasgroup = False
-
-        # execute elements of group
-        for item in self:
-            if isinstance(item, Group) and not item.all_tags[tags.HIDE]:
-                if lastitemwasgroup:
-                    print()
-                lastitemwasgroup = True
-            else:
-                if print_rolls:
-                    self.__align_next_print()
-                lastitemwasgroup = False
-            outcome = item.execute(print_rolls)
-            if not isinstance(item, table.Table):
-                outcomes.append(outcome)
-
-        # calculate and print statistics as needed
-        for stat in tags.stat_tag_strs:
-            if self.all_tags[stat]:
-                self.all_tags[stat].calculate(outcomes)
-                if print_stats:
-                    self.__align_next_print()
-                    self.all_tags[stat].print()
-            
-        if self.all_tags[tags.NICE]:
-            print("Good job!")
- 
-        return self.all_tags[self.all_tags[tags.YIELD].contents].value()
\ No newline at end of file
+    def simulate(self, trials: int, rng: dicerng.DiceRNG = None) -> GroupResult:
+        """Evaluates this group the given number of times. Returns a result with statistics over the outcomes,
+        which yields the first of these statistics.\n
+        With '-seed' or '-workers', the trials are split into chunks that each have their own seed,
+        so the outcome for a given seed is the same no matter how many workers run the chunks."""
+        stat_strs = self.tags.sim_stats
+        keep_counts = any(stat in tags.count_stat_strs for stat in stat_strs)
+        seed, workers = self.tags.seed, self.tags.workers
+        if seed is not None or workers is not None:
+            if seed is None:
+                seed = (rng or dicerng.default).getrandbits(64)
+            workers = 1 if workers is None else (workers or os.cpu_count())
+            acc = self.__simulate_chunks(trials, seed, workers, keep_counts)
+        else:
+            acc = _simulate(self, rng, trials, keep_counts)
+        started = profiling.start()
+        stats = [(stat, *tags.calculate(stat, acc)) for stat in stat_strs]
+        profiling.stop("statistics", started)
+        return GroupResult(self.depth, [], stats, stats[0][1], trials=trials)
+
+    def __simulate_chunks(self, trials: int, seed: int, workers: int, keep_counts: bool) -> statistic.Accumulator:
+        """Runs the trials in chunks of a fixed size, on the given number of worker processes, and merges the chunks in order."""
+        seeder = random.Random(seed)
+        jobs = [(self, seeder.getrandbits(128), min(sim_chunk_trials, trials - start), keep_counts) for start in range(0, trials, sim_chunk_trials)]
+        acc = statistic.Accumulator(keep_counts=keep_counts)
+        if workers == 1 or len(jobs) == 1:
+            for job in jobs:
+                acc.merge(_simulate_chunk(job))
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(min(workers, len(jobs))) as pool:
+                for chunk in pool.map(_simulate_chunk, jobs):
+                    acc.merge(chunk)
+        return acc
+
+    def run(self, rng: dicerng.DiceRNG = None) -> GroupResult:
+        """Executes every member (group or roll) in this group with the given generator without printing.
+        Returns a result that records what to print according to tags, and yields the sum of the outcomes of each member by default."""
+        if self.tags.trials:
+            return self.simulate(self.tags.trials, rng)
+        if self.tags.seed is not None:
+            rng = dicerng.DiceRNG(self.tags.seed)
+
+        items = [item.run(rng) for item in self]
+        outcomes = [r.value for r in items if not isinstance(r, TableResult)]
+
+        # calculate statistics as needed
+        started = profiling.start()
+        stat_strs = self.tags.stats()
+        acc = statistic.Accumulator(outcomes, keep_counts=any(stat in tags.count_stat_strs for stat in stat_strs))
+        stats = [(stat, *tags.calculate(stat, acc)) for stat in stat_strs]
+        profiling.stop("statistics", started)
+        value = next(value for stat, value, _ in stats if stat == self.tags.yield_stat)
+
+        prob = None
+        if self.tags.prob:
+            with distribution.limited():
+                prob = tags.probability(self.tags.prob, self.distribution())
+
+        return GroupResult(
+            self.depth,
+            items,
+            stats,
+            value,
+            show_items=self.tags.has(tags.VERBOSE) or (not self.askedForStat and (len(self) == 1 or self.depth == 0)),
+            show_stats=not (self.tags.has(tags.HIDE) or len(self) == 1),
+            hide=self.tags.has(tags.HIDE),
+            nice=self.tags.has(tags.NICE),
+            prob=prob,
+        )
+
+    def execute(self, print_rolls: bool=True, renderer=render.ansi, rng: dicerng.DiceRNG = None, sink: render.Sink = None):
+        """Executes every member (group or roll) in this group with the given generator and prints according to tags, using the given renderer.
+        Output is written to the given sink, which is left for the caller to flush, or else straight to stdout.
+        Returns the sum of the outcomes of each member by default."""
+        with profiling.phase("execution"):
+            result = self.run(rng)
+        with profiling.phase("printing"):
+            if print_rolls:
+                out = sink or render.Sink()
+                out.emit(result, renderer)
+                if not sink:
+                    out.flush()
+        return result.value
@@ -0,0 +1,72 @@
+import re
+from functools import lru_cache
+from util import ParseException
+import profiling
+
+# kinds of args
+EMPTY = "empty"
+TAG = "tag"
+MODIFIER = "modifier"
+MULTIPLIER = "multiplier"
+LEFT = "left"
+EXPRESSION = "expression"
+TABLE = "table"
+RANDOM_TABLE = "randomtable"
+ROLL = "roll"
+
+# one alternative per kind of arg, tried in order; the first that matches the whole arg determines its kind
+_master_regex = re.compile("|".join([
+    r"(?P<empty>)",
+    r"(?P<tag>-prob\S*|--?\w+)", # malformed -prob tags are left for tags.parse_tag() to report
+    r"(?P<modifier>\..*)",
+    r"(?P<multiplier>x(?P<times>\d+))",
+    r"(?P<left>\[)",
+    r"(?P<expression>\w*=[\d\.\*\+\-/()]+)",
+    r"(?P<table>{(?:\w*=\w*[;}])+=\d+)",
+    r"(?P<randomtable>@(?P<tablename>[/\w]+))",
+    r"(?P<roll>(?:(?P<count>\d*)d(?P<die>\d*)|(?P<bare>\d+))?(?P<options>(?:[\+-]\d+|(?<=\d)[rhl]\d+)*)(?:(?<=\d):(?P<label>.*))?)",
+]))
+_option_regex = re.compile(r"(?P<key>[-+rhl])(?P<val>\d+)")
+
+# the name of the field each roll option sets
+_option_fields = {'+': "bonus", '-': "bonus", 'r': "reroll", 'h': "ceil", 'l': "floor"}
+
+@lru_cache(maxsize=1024)
+def lex(arg: str) -> (str, object):
+    """Classifies and decodes an arg in a single pass. Returns a tuple (kind, value), where value depends on kind:\n
+    MULTIPLIER: the number of copies\n
+    RANDOM_TABLE: the name of the table\n
+    ROLL: a tuple (count, die, bonus, reroll, ceil, floor, label), or None if the arg is not valid\n
+    otherwise: the arg itself"""
+    profiling.count("regex matches") # only counted when the arg is not cached
+    match = _master_regex.fullmatch(arg)
+    if match is None:
+        return ROLL, None
+    kind = match.lastgroup
+    if kind == MULTIPLIER:
+        return kind, int(match.group("times"))
+    if kind == RANDOM_TABLE:
+        return kind, match.group("tablename")
+    if kind == ROLL:
+        return kind, _decode_roll(match)
+    return kind, arg
+
+def _decode_roll(match) -> tuple:
+    if bare := match.group("bare"):
+        count, die = 1, int(bare)
+    else:
+        count, die = int(match.group("count") or 1), int(match.group("die") or 20)
+    fields = {}
+    for option in _option_regex.finditer(match.group("options")):
+        field = _option_fields[option.group("key")]
+        if field in fields:
+            return None # each option may only be given once
+        fields[field] = int(option.group("key") + option.group("val")) if field == "bonus" else int(option.group("val"))
+    return count, die, fields.get("bonus", 0), fields.get("reroll", 0), fields.get("ceil", 0), fields.get("floor", 0), match.group("label") or ""
+
+def roll_spec(arg: str) -> tuple:
+    """Returns the decoded roll spec (count, die, bonus, reroll, ceil, floor, label) of the arg, or raises a ParseException if it is not a roll."""
+    kind, spec = lex(arg)
+    if kind != ROLL or spec is None:
+        raise ParseException("Unable to parse '{}' as roll".format(arg))
+    return spec
@@ -1,4 +1,6 @@
 from util import PATH_TO_DIR, ParseException
+import profiling
+import lexer
 from os import path
 import json
 import re
@@ -8,18 +10,47 @@ macros_file_path = PATH_TO_DIR + "/macros.json"
 def _load_macros() -> dict:
     if not path.exists(macros_file_path):
         return {}
+    profiling.count("file reads")
     with open(macros_file_path) as fp:
         macros = json.load(fp)
         return macros
         # macros = {pair[0]: pair[1] for pair in map(lambda line: line.split(maxsplit=1), fp.readlines())}
 
-macros = _load_macros()
+# the macros are loaded only once, on first use
+_macros = None
+
+# changes whenever any macro changes, so that anything derived from the macros knows to update
+version = 0
+
+def _changed():
+    global version
+    version += 1
+
+def get_macros() -> dict:
+    """Returns the map from macro to value, loading it from file on first use."""
+    global _macros
+    if _macros is None:
+        _macros = _load_macros()
+    return _macros
+
+def unload_macros():
+    """Forgets the loaded macros, so that they are loaded from file again on next use."""
+    global _macros
+    _macros = None
+    _changed()
+
+def __getattr__(name: str):
+    # lets other modules use macros.macros without loading it at import
+    if name == "macros":
+        return get_macros()
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
 
 def _save_macros(macros: dict):
     with open(macros_file_path, 'w') as fp:
         json.dump(macros, fp)
 
 def make_macro(macro: str = None, value: str = None):
+    macros = get_macros()
     if macro:
         print("Making macro '{}'".format(macro))
     else:
@@ -29,24 +60,57 @@ def make_macro(macro: str = None, value: str = None):
         value = input("Value: ")
     macros[macro] = value
     _save_macros(macros)
+    _changed()
     print("Successfully created macro '{}' with value '{}'".format(macro, value))
 
 def delete_macro(macro: str = None):
+    macros = get_macros()
     if not macro:
         macro = input("Macro to delete: ")
     if macro in macros:
         del macros[macro]
         _save_macros(macros)
+        _changed()
         print("Successfully deleted macro '{}'".format(macro))
     else:
         raise ParseException("Failure: '{}' is not a macro. Were you trying to delete a character macro?".format(macro))
 
+def migrate_macros():
+    """Adds parentheses to the expressions of every macro so that they mean what they did before expressions had
+    precedence, when they were evaluated from left to right, e.g. '=_+1/6+1' becomes '=(_+1)/6+1'."""
+    import expression
+    macros = get_macros()
+    changed = {macro: expression.left_to_right_args(value) for macro, value in macros.items()}
+    changed = {macro: value for macro, value in changed.items() if value != macros[macro]}
+    for macro, value in changed.items():
+        print("Changed macro '{}' from '{}' to '{}'".format(macro, macros[macro], value))
+        macros[macro] = value
+    if changed:
+        _save_macros(macros)
+        _changed()
+    print("Migrated {} macro(s)".format(len(changed)))
+
 def list_macros():
+    macros = get_macros()
     print("List of macros:")
     for macro, value in macros.items():
-        print("  {}: {}".format(macro, value))
+        print("  {}: {}{}".format(macro, value, " (never expanded, since it is already a valid arg)" if is_reserved(macro) else ""))
+
+_macro_name_regex = re.compile(r"^[/\w]+$")
+def is_macro_name(arg: str) -> bool:
+    """Returns whether or not the given arg could be the name of a macro (i.e., consists of only letters, numbers, underscore, and slash)"""
+    profiling.count("regex matches")
+    return _macro_name_regex.match(arg) is not None
+
+def is_reserved(arg: str) -> bool:
+    """Returns whether the arg already has a meaning, e.g. '1d20', 'd6', '20' or 'x3'.
+    Such args take precedence over any macro of the same name, which is never expanded, so that they need not load the stores."""
+    return lexer.lex(arg) != (lexer.ROLL, None)
 
 def assert_valid_macro(arg: str):
-    """Raises a ParseException if given arg is not a valid macro (i.e., consists of only letters, numbers, and underscore)"""
-    if not re.match(r"^[/\w]+$", arg):
-        raise ParseException("Invalid macro name: {}".format(arg))
\ No newline at end of file
+    """Raises a ParseException if given arg is not a valid macro (i.e., consists of only letters, numbers, and underscore,
+    and is not already a roll or multiplier)"""
+    if not is_macro_name(arg):
+        raise ParseException("Invalid macro name: {}".format(arg))
+    if is_reserved(arg):
+        raise ParseException("Invalid macro name: {}, which is already a valid arg (e.g. a roll), so would never be expanded".format(arg))
\ No newline at end of file
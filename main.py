@@ -1,22 +1,25 @@
 import sys
-import re
-from random import randint
+import json
 import macros as mac
-from group import Group
-from roll import Roll
 import character
+import expansion
 import util
+import render
+import dicerng
+import profiling
 
-# get user input
-args = sys.argv[1:]
+format_prefix = "--format="
+seed_prefix = "--seed="
+batch_flag = "--batch"
+collapse_prefix = "--collapse="
+detail_prefix = "--detail="
 
-# check if input was given
-if not args:
-    args = input("Enter args: ").split()
-
-# interpret commands
-if args[0] == "!":
+comma = expansion.comma
+left_paren = expansion.left_paren
+right_paren = expansion.right_paren
 
+def run_command(args: list):
+    """Interprets a management command, e.g. ["!", "macro", "list"]."""
     try:
         # character management
         if args[1] == "char":
@@ -34,12 +37,12 @@ if args[0] == "!":
             # viewing current or specified character stats and proficiencies
             elif args[2] == "view":
                 name = util.list_get(args, 3, default_func=character.get_current_character_name)
-                print(str(character.characters[name]))
+                print(str(character.get_existing_character(name)))
             
             # display a list of all characters
             elif args[2] == "list":
                 current = character.get_current_character_name()
-                charlist = list(character.characters.keys())
+                charlist = character.get_character_names()
                 charlist[charlist.index(current)] += " (current)"
                 print("List of characters:")
                 print("  " + "\n  ".join(charlist))
@@ -85,101 +88,175 @@ if args[0] == "!":
             # list macros
             elif args[2] == "list":
                 mac.list_macros()
+
+            # give the expressions of macros made before expressions had precedence the parentheses that keep their meaning
+            elif args[2] == "migrate":
+                mac.migrate_macros()
     except util.ParseException as e:
         print(e)
-    # exit program
-    raise SystemExit()
-
-# if not a command, clean up the arguments and expand macros before parsing
-
-# a list of characters that partition individual arguments
-comma = ','
-left_paren = util.LEFT_PAREN
-right_paren = util.RIGHT_PAREN
-delimiters = [left_paren, right_paren, comma]
-
-def expand_delimiters(arg: str, delimiters: list) -> list:
-    """Partitions the given arg into a list of subarguments using the given delimiters, which are included in the resulting list."""
-    out = [""]
-    for c in arg:
-        if c in delimiters:
-            out += [c, ""]
+
+def group_commas(args: list):
+    """Replaces commas in args with brackets that group the args between them, in a single pass."""
+    # each comma-separated segment starts with a placeholder, which becomes a left bracket if its depth has any commas
+    out = [None]
+    frames = [[0, False]] # for each depth: [index of the current segment's placeholder, whether a comma was found]
+    for arg in args:
+        if arg == comma:
+            frame = frames[-1]
+            out[frame[0]] = left_paren
+            out.append(right_paren)
+            frame[0], frame[1] = len(out), True
+            out.append(None)
+        elif arg == left_paren:
+            out.append(arg)
+            frames.append([len(out), False])
+            out.append(None)
+        elif arg == right_paren and len(frames) > 1:
+            slot, found_comma = frames.pop()
+            if found_comma:
+                out[slot] = left_paren
+                out.append(right_paren)
+            out.append(arg)
         else:
-            out[-1] += c
-    return [a for a in out if a] # remove empty strings
-
-def split_macro(macro: str) -> list:
-    """Splits the value of a macro. Identical to str.split(), except for the case where a macro expands into something that contains a space, which this handles properly."""
-    words = macro.split()
-    apos = "'"
-    i = 0
-    while i < len(words):
-        if apos in words[i]:
-            words[i] = words[i].replace(apos, "")
-            while not apos in words[i]:
-                words[i] += " " + words.pop(i+1)
-            words[i] = words[i].replace(apos, "")
-        elif words[i][-1] == "\\":
-            words[i] = words[i][:-1] + " " + words.pop(i+1)
-        i += 1
-    return words
-            
+            out.append(arg)
+    for slot, found_comma in reversed(frames):
+        if found_comma:
+            out[slot] = left_paren
+            out.append(right_paren)
+    args[:] = [arg for arg in out if arg is not None]
+
+def run_batch(lines, out=None, rng: dicerng.DiceRNG = None):
+    """Interprets each line of lines as the args of a separate roll, writing each result as one line of JSON to out (stdout by default).
+    Every line is rolled with the same generator, so that a seeded batch is reproducible.\n
+    The macros, characters and caches are loaded once and kept for every line, so this is much faster than a process per line."""
+    from group import Group
+    out = out or sys.stdout
+    expander = expansion.Expander(character.Resolver())
+    for line in lines:
+        args = line.split()
+        if not args:
+            continue
+        try:
+            if args[0] == "!":
+                raise util.ParseException("Failure: commands cannot be run in batch mode")
+            with profiling.phase("expansion"):
+                args = expander.expand(args)
+            with profiling.phase("grouping"):
+                group_commas(args)
+            with profiling.phase("parsing"):
+                group = Group(args, rng=rng)
+            with profiling.phase("execution"):
+                result = group.run(rng)
+            d = render.to_dict(result)
+        except util.ParseException as e:
+            d = {"type": "error", "error": str(e)}
+        except Exception as e:
+            # an unexpected failure of one line is reported like any other, rather than ending the batch
+            d = {"type": "error", "error": "{}: {}".format(type(e).__name__, e)}
+        d["input"] = line.strip()
+        with profiling.phase("printing"):
+            out.write(json.dumps(d) + "\n")
+
+def main(args: list):
+    """Interprets and executes the given args, e.g. ["2d20h1", "-mean"], printing the outcome.
+    If profiling, the time taken by each phase is then printed to stderr."""
+    if profiling.PROFILE in args or profiling.enabled:
+        with profiling.session():
+            run([arg for arg in args if arg != profiling.PROFILE])
+    else:
+        run(args)
+
+def run(args: list):
+    """Interprets and executes the given args, printing the outcome."""
+    # options come before the rolls, in any order:
+    #   "--seed=42" seeds the rolls so that they can be reproduced
+    #   "--format=json" chooses how output is rendered
+    #   "--collapse=50" collapses runs of more than this many alike rolls into a summary, or never if 0
+    #   "--detail=rolls.txt" also writes every roll in full to a file
+    #   "--batch rolls.txt" reads many rolls, one per line, from the given file or from stdin
+    rng = None
+    renderer = render.ansi
+    collapse = None
+    detail_path = None
+    batch_path = None
+    while args and args[0].startswith("--"):
+        arg = args.pop(0)
+        if arg.startswith(seed_prefix):
+            seed = arg[len(seed_prefix):]
+            if not seed.isdigit():
+                print("Failure: seed must be a non-negative integer")
+                return
+            rng = dicerng.DiceRNG(int(seed))
+        elif arg.startswith(format_prefix):
+            renderer = render.renderers.get(arg[len(format_prefix):])
+            if not renderer:
+                print("Failure: format must be one of: {}".format(", ".join(render.renderers)))
+                return
+        elif arg.startswith(collapse_prefix):
+            collapse = arg[len(collapse_prefix):]
+            if not collapse.isdigit():
+                print("Failure: collapse must be a non-negative integer")
+                return
+            collapse = int(collapse)
+        elif arg.startswith(detail_prefix):
+            detail_path = arg[len(detail_prefix):]
+        elif arg == batch_flag:
+            batch_path = args.pop(0) if args and not args[0].startswith("--") else "-"
+        else:
+            # not an option, e.g. the supertag "--mean"
+            args.insert(0, arg)
+            break
+
+    if batch_path:
+        if batch_path == "-":
+            run_batch(sys.stdin, rng=rng)
+        else:
+            try:
+                fp = open(batch_path)
+            except OSError as e:
+                print("Failure: could not read {}: {}".format(batch_path, e.strerror))
+                return
+            with fp:
+                run_batch(fp, rng=rng)
+        return
+
+    # check if input was given
+    if not args:
+        args = input("Enter args: ").split()
+
+    # interpret commands
+    if args[0] == "!":
+        run_command(args)
+        return
+
+    # now parse the rolls; imported here so that commands do not need to load the rolling machinery
+    from group import Group
+    try:
+        # if not a command, clean up the arguments and expand macros before parsing
+        with profiling.phase("expansion"):
+            args = expansion.Expander(character.Resolver()).expand(args)
+        with profiling.phase("grouping"):
+            group_commas(args)
+
+        with profiling.phase("parsing"):
+            biggroup = Group(args, rng=rng)
+        if detail_path:
+            try:
+                with open(detail_path, "w") as fp:
+                    execute_group(biggroup, renderer, rng, render.Sink(collapse=collapse, detail=render.Sink(fp)))
+            except OSError as e:
+                print("Failure: could not write {}: {}".format(detail_path, e.strerror))
+        else:
+            execute_group(biggroup, renderer, rng, render.Sink(collapse=collapse))
+    except util.ParseException as e:
+        print(e)
+
+def execute_group(group, renderer, rng: dicerng.DiceRNG, sink: render.Sink):
+    """Executes the group, writing its output to the sink, which is then flushed."""
+    try:
+        group.execute(renderer=renderer, rng=rng, sink=sink)
+    finally:
+        sink.flush()
 
-def expand_macro(arg: str) -> list:
-    """Returns a list of whatever the macro expands into, or if not a macro, just the arg in a list."""
-    # character macro
-    if charroll := character.get_current_character_roll(arg):
-        return split_macro(charroll)
-    # normal macro
-    if arg in mac.macros:
-        return split_macro(mac.macros[arg])
-    return [arg]
-
-# expand everything
-util.expand(args, [expand_macro, lambda arg: expand_delimiters(arg, delimiters)])
-
-# interpret commas for grouping
-i = 0
-while i < len(args):
-    if args[i] == comma:
-        # find indices of all other commas at this depth, and where depth starts and ends
-        comma_indices = [i]
-
-        # find where this depth started
-        depth = 0
-        j = i
-        while depth >= 0 and j > 0:
-            j -= 1
-            if args[j] == right_paren:
-                depth += 1
-            elif args[j] == left_paren:
-                depth -= 1
-        depth_start = j
-
-        # find where this depth ends, and any other commas at this depth
-        depth = 0
-        j = i
-        while depth >= 0 and j < len(args)-1:
-            j += 1
-            if args[j] == left_paren:
-                depth += 1
-            elif args[j] == right_paren:
-                depth -= 1
-            elif args[j] == comma and depth == 0:
-                comma_indices.append(j)
-        depth_end = j
-
-        # remove commas and insert brackets
-        args.insert(depth_end+1, right_paren)
-        for index in reversed(comma_indices):
-            args[index:index+1] = [right_paren, left_paren]
-        args.insert(depth_start, left_paren)
-
-    i += 1
-
-# now parse the rolls
-try:
-    biggroup = Group(args)
-    biggroup.execute()
-except util.ParseException as e:
-    print(e)
\ No newline at end of file
+if __name__ == "__main__":
+    main(sys.argv[1:])
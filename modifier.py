@@ -1,16 +1,15 @@
 import re
+import copy
 from roll import Roll
 import util
 import group
 import expression
+import table
+import profiling
 
 # an arg is a modifier iff it starts with this char
 MODIFIER_INDICATOR = '.'
 
-def is_modifier(arg: str) -> bool:
-    """Returns whether or not the given arg is formatted as a modifier."""
-    return arg[0] == MODIFIER_INDICATOR
-
 # regexes used to extract information from modifier strings
 _target_patternstr = r"\.(@(?P<target>\w+):)?"
 _target_regex = re.compile(_target_patternstr)
@@ -21,52 +20,61 @@ _reroll_regex = re.compile(_target_patternstr + r"r(?P<val>\d+)$")
 _label_regex = re.compile(_target_patternstr + r"label?=(?P<val>\w+)$")
 
 def modify(roll, arg: str):
-    """Modifies the given roll (or rolls, if a group was passed) according to the given arg (a modifier)."""
+    """Returns a copy of the given roll (or rolls, if a group was passed) modified according to the given arg (a modifier).
+    The given roll is left as it is, since it may be shared, e.g. by a multiplier."""
     # recursively apply to groups
     if isinstance(roll, group.Group):
-        for thing in roll:
-            modify(thing, arg)
-        return
+        newgroup = copy.copy(roll)
+        newgroup[:] = [modify(thing, arg) for thing in roll]
+        return newgroup
+    
+    # modify blanks once they are filled in
+    if isinstance(roll, group.Blank):
+        newblank = copy.copy(roll)
+        newblank.modifiers = roll.modifiers + [arg]
+        return newblank
     
-    # don't modifiy expressions
-    if isinstance(roll, expression.Expression):
-        return
+    # don't modifiy expressions or tables
+    if isinstance(roll, (expression.Expression,) + table.table_types):
+        return roll
     
+    profiling.count("modifiers applied")
+
     # don't modify if target does not match, if there is a target
     if targetmatch := _target_regex.match(arg):
         target = targetmatch.group("target")
         if target and roll.label != target:
-            return
+            return roll
 
     # bonus modifier
     if match := _bonus_regex.match(arg):
-        roll.bonus += int(match.group("val"))
+        return roll.replace(bonus=roll.bonus + int(match.group("val")))
     
     # count modifier
     elif match := _count_regex.match(arg):
         val = int(match.group("val"))
         if (type := match.group("type")) == "*":
-            roll.count *= val
+            return roll.replace(count=roll.count * val)
         elif type == '+':
-            roll.count += val
+            return roll.replace(count=roll.count + val)
         else:
-            roll.count = val
+            return roll.replace(count=val)
     
     # high or low modifier
     elif match := _highlow_regex.match(arg):
         val = int(match.group("val"))
         if match.group("type") == "h":
-            roll.ceil = val
+            return roll.replace(ceil=val)
         else:
-            roll.floor = val
+            return roll.replace(floor=val)
     
     # label modifier
     elif match := _label_regex.match(arg):
-        roll.label = match.group("val")
+        return roll.replace(label=match.group("val"))
     
     # reroll modifier
     elif match := _reroll_regex.match(arg):
-        roll.reroll = int(match.group("val"))
+        return roll.replace(reroll=int(match.group("val")))
     
     # invalid modifier
     else:
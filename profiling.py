@@ -0,0 +1,68 @@
+import sys
+import time
+from contextlib import contextmanager
+from os import environ
+
+# Timings of each phase of a command, and counters of the work done on hot paths, for finding out where the time
+# goes. Profiling is turned on with the '-profile' tag or by setting the ROLLPY_PROFILE environment variable;
+# otherwise each timing or count costs a single check of `enabled`.
+
+PROFILE = "-profile"
+
+enabled = bool(environ.get("ROLLPY_PROFILE"))
+
+# seconds spent in each phase, and the value of each counter, in the order first seen
+phases = {}
+counters = {}
+
+# the phases of a command in the order they happen, and the phases that are part of another
+phase_order = ["expansion", "grouping", "parsing", "execution", "statistics", "printing"]
+subphases = {"statistics": "execution"}
+
+@contextmanager
+def session(out=None):
+    """Profiles the body of a with statement, then writes the report to out (stderr by default).
+    Profiling is then turned back off, unless it was turned on by the environment variable."""
+    global enabled
+    was_enabled, enabled = enabled, True
+    phases.clear()
+    counters.clear()
+    try:
+        yield
+    finally:
+        enabled = was_enabled
+        print(report(), file=out or sys.stderr)
+
+def count(counter: str, n: int = 1):
+    """Adds n to the given counter, if profiling."""
+    if enabled:
+        counters[counter] = counters.get(counter, 0) + n
+
+def start() -> float:
+    """Returns the time to pass to stop() at the end of a phase."""
+    return time.perf_counter() if enabled else 0.0
+
+def stop(name: str, started: float):
+    """Adds the time since started, as returned by start(), to the given phase, if profiling."""
+    if enabled:
+        phases[name] = phases.get(name, 0.0) + time.perf_counter() - started
+
+class phase:
+    """Times the body of a with statement as the given phase, e.g. `with profiling.phase("parsing"):`."""
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = start()
+
+    def __exit__(self, *exc):
+        stop(self.name, self.started)
+
+def report() -> str:
+    """Returns the timings and counts as lines of text."""
+    lines = ["Profile:"]
+    for name in sorted(phases, key=lambda name: phase_order.index(name) if name in phase_order else len(phase_order)):
+        within = " (part of {})".format(subphases[name]) if name in subphases else ""
+        lines.append("  {}{}: {:.3f} ms".format(name, within, phases[name] * 1000))
+    lines += ["  {}: {}".format(name, n) for name, n in counters.items()]
+    return "\n".join(lines)
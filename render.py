@@ -0,0 +1,295 @@
+import json
+import sys
+from collections import Counter
+from numbers import Real
+from util import make_strikethrough, make_bold
+from result import RollResult, CountResult, ExpressionResult, TableResult, GroupResult
+
+# Renderers turn a result (see result.py) into a string to be printed, which is written to a Sink.
+
+# a run of more alike results than this in one group is collapsed into a summary and a histogram, or never if 0
+collapse_threshold = 100
+
+# the most rows, and the widest bar, of the histogram of a collapsed run
+histogram_rows = 20
+histogram_width = 40
+
+def _plain_strikethrough(s: str) -> str:
+    return "~" + s + "~"
+
+def _plain_bold(s: str) -> str:
+    return s
+
+class _TextWriter:
+    """Collects text the way successive calls to print() would, or passes it straight on to the given write function.
+    collapse: see collapse_threshold"""
+    def __init__(self, ansi: bool, collapse: int = 0, write=None):
+        self.parts = []
+        self.write = write or self.parts.append
+        self.collapse = collapse
+        self.strikethrough = make_strikethrough if ansi else _plain_strikethrough
+        self.bold = make_bold if ansi else _plain_bold
+
+    def indent(self, depth: int):
+        """Writes a number of spaces proportional to depth, but no newline, so that the next line is aligned."""
+        self.write("  " * depth)
+
+    def line(self, s: str = ""):
+        self.write(s + "\n")
+
+    def text(self) -> str:
+        return "".join(self.parts)[:-1] # the final newline is left to print()
+
+def _roll_heading(r, out: _TextWriter) -> str:
+    outcomestr = out.bold(str(r.total))
+    s = "Rolling {}: {}".format(r.roll, r.die_sum if r.bonus else outcomestr)
+    if r.bonus:
+        s += " -> " + outcomestr
+    if r.label:
+        s += " " + r.label
+    return s
+
+def _write_roll(r: RollResult, out: _TextWriter):
+    s = _roll_heading(r, out)
+    if len(r.firsts) > 1 or r.rerolls is not None:
+        result_strs = [str(first) for first in r.firsts]
+        if r.rerolls is not None:
+            for i, rerolled in enumerate(r.rerolls):
+                if rerolled:
+                    result_strs[i] = out.strikethrough(result_strs[i]) + " " + str(rerolled)
+        for i in r.dropped:
+            result_strs[i] = out.strikethrough(result_strs[i])
+        s += " ({})".format(", ".join(result_strs))
+    out.line(s)
+
+def _write_counts(r: CountResult, out: _TextWriter):
+    # e.g. "Rolling 1000000d6,r1,h10: 60 (166512 rerolled; ~1: 27760~, ..., 6: 10 of 194000)"
+    # faces with no dice kept are struck through, or only totalled if the die has many faces
+    list_dropped = len(r.counts) <= histogram_rows
+    faces, dropped = [], 0
+    for face, (count, kept) in enumerate(zip(r.counts, r.kept), 1):
+        if not count:
+            continue
+        if kept == count:
+            faces.append("{}: {}".format(face, count))
+        elif kept:
+            faces.append("{}: {} of {}".format(face, kept, count))
+        elif list_dropped:
+            faces.append(out.strikethrough("{}: {}".format(face, count)))
+        else:
+            dropped += count
+    if dropped:
+        faces.insert(0, out.strikethrough("{} dropped".format(dropped)))
+    rerolled = "{} rerolled; ".format(r.rerolled) if r.rerolled else ""
+    out.line("{} ({}{})".format(_roll_heading(r, out), rerolled, ", ".join(faces)))
+
+def _write_group(g: GroupResult, out: _TextWriter):
+    if g.trials:
+        out.indent(g.depth)
+        out.line("Simulated {} trials:".format(g.trials))
+        for _, _, output in g.stats:
+            out.indent(g.depth)
+            out.line(output)
+        return
+
+    lastitemwasgroup = False
+    for item, run in _runs(g.items, out.collapse):
+        if run:
+            if g.show_items or isinstance(item, GroupResult):
+                if lastitemwasgroup:
+                    out.line()
+                _write_summary(run, g.depth, out)
+            lastitemwasgroup = False
+            continue
+        if isinstance(item, GroupResult) and not item.hide:
+            if lastitemwasgroup:
+                out.line()
+            lastitemwasgroup = True
+        else:
+            if g.show_items:
+                out.indent(g.depth)
+            lastitemwasgroup = False
+        _write(item, g.show_items, out)
+
+    if g.show_stats:
+        for _, _, output in g.stats:
+            out.indent(g.depth)
+            out.line(output)
+    if g.prob:
+        out.indent(g.depth)
+        out.line(g.prob[2])
+    if g.nice:
+        out.line("Good job!")
+
+def _signature(r) -> str:
+    """Returns what was rolled for a result, e.g. '4d6,h3' or '[1d20+5, 1d8]', without the outcome."""
+    if isinstance(r, (RollResult, CountResult)):
+        return r.roll + (" " + r.label if r.label else "")
+    if isinstance(r, ExpressionResult):
+        return r.label + "=" if r.label else "expression"
+    if isinstance(r, TableResult):
+        return "@" + r.name if r.name else "table"
+    return "[{}]".format(", ".join(_signature(item) for item in r.items))
+
+def _kind(r):
+    """Returns a key that is equal for results of alike items, which is quicker to compare than their signatures."""
+    if isinstance(r, (RollResult, CountResult)):
+        return r.roll, r.label
+    if isinstance(r, GroupResult):
+        return tuple(map(_kind, r.items))
+    return type(r), r.label if isinstance(r, ExpressionResult) else r.name
+
+def _runs(items: list, collapse: int):
+    """Yields a tuple (item, None) for each item, except for runs of more than collapse items that are alike,
+    which are yielded as a single tuple (first item, run)."""
+    if not collapse or len(items) <= collapse:
+        for item in items:
+            yield item, None
+        return
+    kinds = [_kind(item) for item in items]
+    start = 0
+    while start < len(items):
+        end = start + 1
+        while end < len(items) and kinds[end] == kinds[start]:
+            end += 1
+        if end - start > collapse:
+            yield items[start], items[start:end]
+        else:
+            for item in items[start:end]:
+                yield item, None
+        start = end
+
+def _write_summary(run: list, depth: int, out: _TextWriter):
+    """Writes a line summarising the outcomes of a run of alike results, e.g. '1d20 x5000: min 1, max 20, mean 10.49',
+    and a histogram of them."""
+    values = [r.value for r in run]
+    out.indent(depth)
+    if all(isinstance(value, Real) for value in values):
+        low, high = min(values), max(values)
+        out.line("{} x{}: min {}, max {}, mean {:.2f}".format(_signature(run[0]), len(run), low, high, sum(values) / len(values)))
+        counts = Counter(values)
+        if len(counts) <= histogram_rows:
+            rows = [(str(value), counts[value]) for value in sorted(counts)]
+        elif all(isinstance(value, int) for value in values):
+            width = -(-(high - low + 1) // histogram_rows)
+            binned = Counter((value - low) // width for value in values)
+            rows = [("{}-{}".format(low + i * width, min(low + (i + 1) * width - 1, high)), binned[i]) for i in range(-(-(high - low + 1) // width))]
+        else:
+            width = (high - low) / histogram_rows
+            binned = Counter(min(int((value - low) / width), histogram_rows - 1) for value in values)
+            rows = [("{:.4g}-{:.4g}".format(low + i * width, low + (i + 1) * width), binned[i]) for i in range(histogram_rows)]
+    else:
+        out.line("{} x{}:".format(_signature(run[0]), len(run)))
+        rows = Counter(str(value) for value in values).most_common(histogram_rows)
+
+    peak = max(n for _, n in rows)
+    label_width = max(len(label) for label, _ in rows)
+    for label, n in rows:
+        out.indent(depth + 1)
+        out.line("{} | {} {}".format(label.rjust(label_width), "#" * round(histogram_width * n / peak), n))
+
+def _write(r, show: bool, out: _TextWriter):
+    if isinstance(r, GroupResult):
+        _write_group(r, out)
+    elif not show:
+        pass
+    elif isinstance(r, RollResult):
+        _write_roll(r, out)
+    elif isinstance(r, CountResult):
+        _write_counts(r, out)
+    elif isinstance(r, ExpressionResult):
+        out.line("{} = {}".format(r.label, r.value))
+    elif isinstance(r, TableResult):
+        out.line("Outcome of {}: {}".format(r.name or "table", r.value))
+
+def text(r, ansi: bool = True, collapse: int = 0) -> str:
+    """Renders a result as text, using ANSI strikethrough and bold if asked for.
+    collapse: see collapse_threshold"""
+    out = _TextWriter(ansi, collapse)
+    _write(r, True, out)
+    return out.text()
+
+def write_text(r, sink: "Sink", ansi: bool = False, collapse: int = 0):
+    """Renders a result as text straight to the sink, line by line, without holding all of it in memory."""
+    _write(r, True, _TextWriter(ansi, collapse, sink.write))
+
+def _jsonable(value):
+    return sorted(value) if isinstance(value, set) else value
+
+def to_dict(r) -> dict:
+    """Converts a result to a dict of plain values, as would be parsed from JSON."""
+    if isinstance(r, RollResult):
+        dice = []
+        for i, first in enumerate(r.firsts):
+            die = {"value": first, "kept": i not in r.dropped}
+            if r.rerolls is not None and r.rerolls[i]:
+                die["rerolled"] = r.rerolls[i]
+            dice.append(die)
+        return {"type": "roll", "roll": r.roll, "label": r.label, "bonus": r.bonus, "dice": dice, "total": r.total}
+    if isinstance(r, CountResult):
+        faces = [{"face": face, "count": count, "kept": kept} for face, (count, kept) in enumerate(zip(r.counts, r.kept), 1) if count]
+        return {"type": "roll", "roll": r.roll, "label": r.label, "bonus": r.bonus, "faces": faces, "rerolled": r.rerolled, "total": r.total}
+    if isinstance(r, ExpressionResult):
+        return {"type": "expression", "label": r.label, "value": r.value}
+    if isinstance(r, TableResult):
+        d = {"type": "table", "value": r.value}
+        if r.name:
+            d["table"] = r.name
+        return d
+    d = {"type": "group", "items": [to_dict(item) for item in r.items], "stats": {tag: _jsonable(value) for tag, value, _ in r.stats}, "value": _jsonable(r.value)}
+    if r.prob:
+        d["prob"] = {"tag": r.prob[0], "value": r.prob[1]}
+    if r.trials:
+        d["trials"] = r.trials
+    return d
+
+# collapse is unused, but accepted so that every renderer can be called alike
+def to_json(r, collapse: int = None) -> str:
+    """Renders a result as a single line of JSON."""
+    return json.dumps(to_dict(r))
+
+def ansi(r, collapse: int = None) -> str:
+    return text(r, ansi=True, collapse=collapse_threshold if collapse is None else collapse)
+
+def plain(r, collapse: int = None) -> str:
+    return text(r, ansi=False, collapse=collapse_threshold if collapse is None else collapse)
+
+renderers = {"ansi": ansi, "plain": plain, "json": to_json}
+
+class Sink:
+    """Where output goes. Text is buffered and passed on to the file in chunks of at least buffer_size characters,
+    rather than a write per line, until flush() is called.\n
+    collapse: see collapse_threshold, or None for the default\n
+    detail: a sink, if any, that is also sent every result in full, without collapsing or ANSI codes"""
+    def __init__(self, fp=None, collapse: int = None, detail: "Sink" = None, buffer_size: int = 1 << 16):
+        self.fp = fp or sys.stdout
+        self.collapse = collapse
+        self.detail = detail
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.size = 0
+
+    def write(self, s: str):
+        self.parts.append(s)
+        self.size += len(s)
+        if self.size >= self.buffer_size:
+            self.__write_parts()
+
+    def emit(self, r, renderer=ansi):
+        """Writes a result rendered with the given renderer, as print() would, and in full to the detail sink."""
+        if output := renderer(r, self.collapse):
+            self.write(output + "\n")
+        if self.detail:
+            write_text(r, self.detail)
+
+    def flush(self):
+        self.__write_parts()
+        self.fp.flush()
+        if self.detail:
+            self.detail.flush()
+
+    def __write_parts(self):
+        if self.parts:
+            self.fp.write("".join(self.parts))
+            self.parts.clear()
+            self.size = 0
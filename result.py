@@ -0,0 +1,79 @@
+# Results of execution, which record what happened without formatting any of it. See render.py for formatting.
+
+class RollResult:
+    """The outcome of a roll, including each die."""
+    __slots__ = ("roll", "label", "bonus", "firsts", "rerolls", "dropped", "die_sum", "total")
+
+    def __init__(self, roll: str, label: str, bonus: int, firsts: list, rerolls: list, dropped: set, die_sum: int):
+        """roll: the roll as a string, e.g. "2d20,h1"\n
+        firsts: the first number on each die\n
+        rerolls: the number on each die after rerolling, or None if it was not rerolled (or None if no dice can be rerolled)\n
+        dropped: the indices of dice that were not kept"""
+        self.roll = roll
+        self.label = label
+        self.bonus = bonus
+        self.firsts = firsts
+        self.rerolls = rerolls
+        self.dropped = dropped
+        self.die_sum = die_sum
+        self.total = die_sum + bonus
+
+    @property
+    def value(self) -> int:
+        return self.total
+
+class CountResult:
+    """The outcome of a roll of so many dice that only how many landed on each face is recorded."""
+    __slots__ = ("roll", "label", "bonus", "counts", "rerolled", "kept", "die_sum", "total")
+
+    def __init__(self, roll: str, label: str, bonus: int, counts: list, rerolled: int, kept: list, die_sum: int):
+        """counts: the number of dice on each face, from 1 up, after rerolling\n
+        rerolled: the number of dice that were rerolled\n
+        kept: the number of dice on each face that were kept"""
+        self.roll = roll
+        self.label = label
+        self.bonus = bonus
+        self.counts = counts
+        self.rerolled = rerolled
+        self.kept = kept
+        self.die_sum = die_sum
+        self.total = die_sum + bonus
+
+    @property
+    def value(self) -> int:
+        return self.total
+
+class ExpressionResult:
+    __slots__ = ("label", "value")
+
+    def __init__(self, label: str, value: int):
+        self.label = label
+        self.value = value
+
+class TableResult:
+    __slots__ = ("value", "name")
+
+    def __init__(self, value: str, name: str = ""):
+        """name: the name of the random table drawn from, if any"""
+        self.value = value
+        self.name = name
+
+class GroupResult:
+    """The outcome of a group, including the results of its members and its statistics."""
+    __slots__ = ("depth", "items", "stats", "prob", "trials", "show_items", "show_stats", "hide", "nice", "value")
+
+    def __init__(self, depth: int, items: list, stats: list, value, show_items: bool = True, show_stats: bool = True, hide: bool = False, nice: bool = False, prob: tuple = None, trials: int = 0):
+        """items: the results of each member\n
+        stats: a list of (tag, value, output string) for each statistic\n
+        prob: a tuple (tag, value, output string) for the chance asked for with -prob, if any\n
+        trials: the number of trials if the group was simulated, in which case the stats are over the trials"""
+        self.depth = depth
+        self.items = items
+        self.stats = stats
+        self.value = value
+        self.show_items = show_items
+        self.show_stats = show_stats
+        self.hide = hide
+        self.nice = nice
+        self.prob = prob
+        self.trials = trials
@@ -1,101 +1,193 @@
-import re
-from random import randint
-from util import make_strikethrough, ParseException, make_bold
+import heapq
+import weakref
+import dicerng
+import distribution
+import lexer
+import render
+import profiling
+from result import RollResult, CountResult
+
+# rolls of more dice than this are rolled by counting how many dice land on each face, rather than keeping every die
+count_threshold = 10000
+
+# the rolls that currently exist, by spec, so that equal rolls are shared rather than repeated
+_interned = weakref.WeakValueDictionary()
 
 class Roll:
-    count_regex = re.compile(r"(?P<take>(?P<val>\d*)d)")                  # finds the count, or number of dice to roll
-    die_regex = re.compile(r"(?:d|^)(?P<take>(?P<val>\d+))(?!d|\d)")      # finds the die (type) to roll
-    bonus_regex = re.compile(r"(?P<take>(?P<val>[\+-]\d+))")              # finds the bonus or penalty to the roll
-    reroll_regex = re.compile(r"\d(?P<take>r(?P<val>\d+))")                 # finds the threshold for rerolling
-    ceil_regex = re.compile(r"\d(?P<take>h(?P<val>\d+))")                   # finds the top n dice to take
-    floor_regex = re.compile(r"\d(?P<take>l(?P<val>\d+))")                  # finds the bottom n dice to take
-    label_regex = re.compile(r"\d(?P<take>:(?P<val>.*))")                   # finds the label string
-
-    def __init__(self, arg: str):
-        """Initializes a new roll based on the given input string (e.g. "2d20h1")"""
-        self.count, counttake = Roll.get_val(Roll.count_regex, arg, 1, 1)
-        self.die, dietake = Roll.get_val(Roll.die_regex, arg, 20)
-        self.bonus, bonustake = Roll.get_val(Roll.bonus_regex, arg, 0)
-        self.reroll, rerolltake = Roll.get_val(Roll.reroll_regex, arg, 0, 1)
-        self.ceil, ceiltake = Roll.get_val(Roll.ceil_regex, arg, 0, 1)
-        self.floor, floortake = Roll.get_val(Roll.floor_regex, arg, 0, 1)
-        self.label, labeltake = Roll.get_val(Roll.label_regex, arg, "", "", interpreter=str)
-
-        self.is_valid = True
-        # ensure that every part of the input string is used precisely once (i.e., that the string is valid)
-        takes = [counttake, dietake, bonustake, rerolltake, ceiltake, floortake, labeltake]
-        reduced_arg = arg
-        for take in takes:
-            if take in reduced_arg:
-                reduced_arg = reduced_arg.replace(take, "", 1)
-            else:
-                self.is_valid = False
-        if reduced_arg:
-            self.is_valid = False
-        if not self.is_valid:
-            raise ParseException("Unable to parse '{}' as roll".format(arg))
-
-    @staticmethod
-    def get_val(regex, s: str, default_if_absent: int, default_if_empty: int = 0, interpreter = int) -> (str, str):
-        """Finds a value in a string s. If no value exists, returns default.
-        Return: a tuple (val, take) where take is the part of the given string that was actually used."""
-        if (m := regex.search(s)) is None:
-            return default_if_absent, ""
-        return interpreter(m.group("val") or default_if_empty), m.group("take")
-    
-    def execute(self, print_output=True) -> int:
-        """Executes the roll. Results are returned and the procedure is printed."""
-        if not self.is_valid:
-            return -1
-
-        # find sum of dice and preliminary result string
-        results = []
-        result_strs = []
-        for _ in range(self.count):
-            first, rerolled = self.get_die_roll()
-            results.append(rerolled or first)
-            result_strs.append(make_strikethrough(str(first)) + " " + str(rerolled) if rerolled else str(first))
-        die_sum = sum(results)
+    """An immutable roll, e.g. 2d20h1. Rolls with the same spec are the same object, so they can be shared freely,
+    e.g. by multipliers; use replace() to get a modified roll. What happens when it is executed is kept in a RollResult."""
+    __slots__ = ("count", "die", "bonus", "reroll", "ceil", "floor", "label", "text", "__weakref__")
+    fields = ("count", "die", "bonus", "reroll", "ceil", "floor", "label")
 
-        # find highs and lows if needed
-        removed_results = []
-        if self.ceil:
-            removed_results += sorted(results)[:-self.ceil]
-        if self.floor:
-            removed_results += sorted(results)[self.floor:]
-        for rr in removed_results:
-                rri = results.index(rr)
-                results[rri] = 0 # change the value so it does not get indexed again
-                die_sum -= rr
-                result_strs[rri] = make_strikethrough(result_strs[rri])
+    def __new__(cls, arg: str):
+        """Returns the roll described by the given input string (e.g. "2d20h1")"""
+        return cls.from_spec(lexer.roll_spec(arg))
+
+    @classmethod
+    def from_spec(cls, spec: tuple):
+        """Returns the roll with the given spec (count, die, bonus, reroll, ceil, floor, label)."""
+        roll = _interned.get(spec)
+        if roll is None:
+            roll = object.__new__(cls)
+            for field, value in zip(cls.fields, spec):
+                object.__setattr__(roll, field, value)
+            # formatted once, since every result records it
+            object.__setattr__(roll, "text", roll._format())
+            _interned[spec] = roll
+        return roll
 
-        total = die_sum + self.bonus
+    def spec(self) -> tuple:
+        return (self.count, self.die, self.bonus, self.reroll, self.ceil, self.floor, self.label)
 
-        outcomestr = make_bold(str(total))
+    def replace(self, **changes):
+        """Returns the roll that is the same as this one except for the given fields, e.g. replace(ceil=1)."""
+        return Roll.from_spec(tuple(changes.get(field, value) for field, value in zip(Roll.fields, self.spec())))
 
-        # convert to string
+    def __setattr__(self, name, value):
+        raise AttributeError("Rolls are immutable; use replace() to change '{}'".format(name))
+
+    def __reduce__(self):
+        # rolls are interned again when unpickled, e.g. by simulation workers
+        return (Roll.from_spec, (self.spec(),))
+    
+    def run(self, rng: dicerng.DiceRNG = None) -> RollResult:
+        """Executes the roll without printing, using the given generator or the default one. Returns a result recording each die,
+        or how many dice landed on each face for rolls of more than count_threshold dice."""
+        if self.count > count_threshold and self.die:
+            counts, rerolled, kept = self.roll_counts(rng or dicerng.default)
+            return CountResult(self.text, self.label, self.bonus, counts, rerolled, kept, _counted_sum(kept))
+        firsts, rerolls = self.roll_dice(rng or dicerng.default)
+        results = firsts if rerolls is None else [rerolled or first for first, rerolled in zip(firsts, rerolls)]
+
+        # find highs and lows if needed
+        if self.ceil or self.floor:
+            kept = self.kept_indices(results)
+            die_sum = sum(results[i] for i in kept)
+            dropped = set(range(self.count)).difference(kept)
+        else:
+            die_sum = sum(results)
+            dropped = set()
+        return RollResult(self.text, self.label, self.bonus, firsts, rerolls, dropped, die_sum)
+
+    def execute(self, print_output=True, rng: dicerng.DiceRNG = None) -> int:
+        """Executes the roll. Results are returned and the procedure is printed."""
+        result = self.run(rng)
         if print_output:
-            print_str = "Rolling {}: {}".format(str(self), die_sum if self.bonus else outcomestr)
-            if self.bonus:
-                print_str += " -> " + outcomestr
-            if self.label:
-                print_str += " " + self.label
-            if self.count > 1 or self.reroll:
-                print_str += " ({})".format(", ".join(result_strs))
-            print(print_str)
-        return total
+            print(render.text(result))
+        return result.total
     
-    def get_die_roll(self) -> (int, int):
-        """Rolls a single die, rerolling if below the reroll threshhold.\n
-        Returns a tuple of ints: (final number on die, number on die before reroll [or None])"""
+    def evaluate(self, rng: dicerng.DiceRNG = None) -> int:
+        """Executes the roll without printing or recording the individual dice. Returns the total."""
+        rng = rng or dicerng.default
         if self.die == 0:
-            return 0, (0 if self.reroll else None)
-        result = randint(1, self.die)
-        if result <= self.reroll:
-            return result, randint(1, self.die)
-        return result, None
-    
+            return self.bonus
+        if self.count > count_threshold:
+            return _counted_sum(self.roll_counts(rng)[2]) + self.bonus
+        results = rng.dice(self.die, self.count)
+        if profiling.enabled:
+            self._count_dice(results)
+        if self.reroll:
+            roll, reroll, die = rng.roll, self.reroll, self.die
+            results = [roll(die) if result <= reroll else result for result in results]
+        if self.ceil and not self.floor:
+            return sum(heapq.nlargest(self.ceil, results)) + self.bonus
+        if self.floor and not self.ceil:
+            return sum(heapq.nsmallest(self.floor, results)) + self.bonus
+        start, stop = self.kept_range()
+        if start > 0 or stop < self.count:
+            results = sorted(results)[start:stop]
+        return sum(results) + self.bonus
+
+    def kept_indices(self, results: list) -> list:
+        """Returns the indices of the results that are kept according to the h/l rules.
+        Among equal results, the later ones are kept. Takes O(n log k) time to keep k of n dice."""
+        indices = range(len(results))
+        if self.ceil and not self.floor:
+            return heapq.nlargest(self.ceil, indices, key=lambda i: (results[i], i))
+        if self.floor and not self.ceil:
+            return heapq.nsmallest(self.floor, indices, key=lambda i: (results[i], -i))
+        start, stop = self.kept_range()
+        return sorted(indices, key=lambda i: (results[i], i))[start:stop]
+
+    def kept_counts(self, counts: list) -> list:
+        """Returns how many dice on each face are kept according to the h/l rules, given how many landed on each face from 1 up.
+        Takes O(faces) time."""
+        start, stop = self.kept_range()
+        if start == 0 and stop == self.count:
+            return counts
+        kept, below = [], 0
+        for count in counts:
+            # the dice on this face are those from below to below + count once sorted, of which those in [start, stop) are kept
+            kept.append(max(0, min(below + count, stop) - max(below, start)))
+            below += count
+        return kept
+
+    def kept_range(self) -> (int, int):
+        """Returns the range (start, stop) of dice that are kept, once the dice are sorted from lowest to highest."""
+        start = max(0, self.count - self.ceil) if self.ceil else 0
+        stop = min(self.count, self.floor) if self.floor else self.count
+        return start, stop
+
+    def execute_batch(self, n: int, rng: dicerng.DiceRNG = None):
+        """Executes the roll n times without printing. Returns the n totals, as a numpy array if numpy is available."""
+        try:
+            import numpy as np # imported here since it is slow to import and rarely needed
+        except ImportError:
+            np = None
+        if np is None:
+            return [self.evaluate(rng) for _ in range(n)]
+
+        start, stop = self.kept_range()
+        if self.die == 0 or start >= stop:
+            return np.full(n, self.bonus, dtype=np.int64)
+        nprng = np.random.default_rng((rng or dicerng.default).getrandbits(128))
+        results = nprng.integers(1, self.die + 1, size=(n, self.count), dtype=np.int64)
+        if self.reroll:
+            rerolled = results <= self.reroll
+            results[rerolled] = nprng.integers(1, self.die + 1, size=np.count_nonzero(rerolled), dtype=np.int64)
+        if stop - start < self.count:
+            results = np.partition(results, [start, stop - 1], axis=1)[:, start:stop]
+        return results.sum(axis=1) + self.bonus
+
+    def distribution(self) -> dict:
+        """Returns the exact probability distribution of the roll's total, as a map from total to probability."""
+        start, stop = self.kept_range()
+        face_dist = distribution.die(self.die, self.reroll)
+        dice_dist = distribution.keep(face_dist, self.count, self.count - stop, self.count - start)
+        return distribution.shift(dice_dist, self.bonus)
+
+    def roll_dice(self, rng: dicerng.DiceRNG) -> (list, list):
+        """Rolls every die, rerolling those at or below the reroll threshhold.\n
+        Returns a tuple of lists: (first number on each die, number on each die after reroll [or None if not rerolled]),
+        where the second list is None if no dice can be rerolled."""
+        if self.die == 0:
+            return [0] * self.count, ([0] * self.count if self.reroll else None)
+        firsts = rng.dice(self.die, self.count)
+        if profiling.enabled:
+            self._count_dice(firsts)
+        if not self.reroll:
+            return firsts, None
+        roll, reroll, die = rng.roll, self.reroll, self.die
+        return firsts, [roll(die) if first <= reroll else None for first in firsts]
+
+    def roll_counts(self, rng: dicerng.DiceRNG) -> (list, int, list):
+        """Rolls every die, rerolling those at or below the reroll threshhold, keeping only how many land on each face.\n
+        Returns a tuple (number of dice on each face from 1 up after rerolling, number of dice rerolled, number of those kept on each face)."""
+        counts = rng.counts(self.die, self.count)
+        rerolled = sum(counts[:self.reroll])
+        if rerolled:
+            rerolls = rng.counts(self.die, rerolled)
+            counts = [(count if face > self.reroll else 0) + again for face, (count, again) in enumerate(zip(counts, rerolls), 1)]
+        profiling.count("dice rolled", self.count + rerolled)
+        return counts, rerolled, self.kept_counts(counts)
+
+    def _count_dice(self, firsts: list):
+        profiling.count("dice rolled", len(firsts) + sum(1 for first in firsts if first <= self.reroll))
+
     def __str__(self):
+        return self.text
+
+    def _format(self) -> str:
         s = "{}d{}".format(self.count, self.die)
         if self.bonus > 0:
             s += "+" + str(self.bonus)
@@ -110,9 +202,9 @@ class Roll:
         return s
     
     def clone(self):
-        """Clones the roll, returning an identical Roll."""
-        newroll = Roll.__new__(Roll)
-        fields = [a for a in dir(self) if not a.startswith('__') and not callable(getattr(self, a))]
-        for field in fields:
-            dir(newroll)[field] = dir(self)[field]
-        return newroll
\ No newline at end of file
+        """Returns an identical Roll, which, as rolls are immutable, is this roll."""
+        return self
+
+def _counted_sum(counts: list) -> int:
+    """Returns the sum of the dice, given how many landed on each face from 1 up."""
+    return sum(face * count for face, count in enumerate(counts, 1))
@@ -0,0 +1,69 @@
+import io
+import json
+import os
+import signal
+import socketserver
+import sys
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+from util import SOCKET_PATH
+import macros
+import character
+import main
+
+# Keeps the macro and character stores, compiled regexes, and parse caches loaded between rolls.
+# Start with `python server.py`, then roll with `python client.py ...`.
+
+_mtimes = {}
+
+def _changed(file_path: str) -> bool:
+    """Returns whether the file was modified since the last check."""
+    mtime = os.path.getmtime(file_path) if os.path.exists(file_path) else None
+    changed = _mtimes.get(file_path, mtime) != mtime
+    _mtimes[file_path] = mtime
+    return changed
+
+def refresh_stores():
+    """Reloads the macro and character stores if their files were modified, e.g. by another process."""
+    if _changed(macros.macros_file_path):
+        macros.unload_macros()
+    if _changed(character.characters_db_path):
+        character.unload_characters()
+
+class RollHandler(socketserver.StreamRequestHandler):
+    """Reads a line of JSON holding a list of args, and streams back what main.py would print for them."""
+    def handle(self):
+        args = json.loads(self.rfile.readline())
+        out = io.TextIOWrapper(self.wfile, encoding="utf-8", write_through=True)
+        stdin = sys.stdin
+        sys.stdin = io.StringIO() # there is no user to answer prompts
+        try:
+            refresh_stores()
+            with redirect_stdout(out), redirect_stderr(out): # e.g. for the report of '-profile'
+                main.main(args)
+        except EOFError:
+            out.write("Failure: this command needs input, so it must be run without the server.\n")
+        except Exception:
+            out.write(traceback.format_exc())
+        finally:
+            sys.stdin = stdin
+            out.flush()
+            out.detach()
+
+def serve(socket_path: str = SOCKET_PATH):
+    """Serves rolls on a Unix socket until interrupted."""
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    refresh_stores()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    with socketserver.UnixStreamServer(socket_path, RollHandler) as server:
+        print("Serving rolls on", socket_path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+
+if __name__ == "__main__":
+    serve(*sys.argv[1:2])
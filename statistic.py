@@ -1,39 +1,135 @@
+from util import ParseException
 
-def mean(ls):
-    mean = sum(ls) / len(ls)
-    return mean, "Mean: {}".format(mean)
-
-def total(ls):
-    total = sum(ls)
-    return total, "Total: {}".format(total)
-
-def std(ls):
-    if len(ls) < 1:
-        return -1, "Unable to find standard deviation of length-1 list."
-    mean = sum(ls) / len(ls)
-    std = (sum([(outcome - mean) ** 2 for outcome in ls]) / (len(ls) - 1)) ** .5
-    return std, "Standard Deviation: {:0.2f}".format(std)
-
-def median(ls):
-    median = (ls[int(len(ls)/2)] + ls[int((len(ls) - 1)/2)])/2
-    return median, "Median: {}".format(median)
-
-def minimum(ls):
-    minv = min(ls)
-    return minv, "Minimum: {}".format(minv)
-
-def maximum(ls):
-    maxv = max(ls)
-    return maxv, "Maximum: {}".format(maxv)
-
-def range(ls):
-    range = max(ls) - min(ls)
-    return range, "Range: {}".format(range)
-
-def mode(ls):
-    counts = {}
-    for el in ls:
-        counts[el] = counts[el] + 1 if el in counts else 1
-    max_count = max(counts.values())
-    modes = set([el for el in ls if counts[el] == max_count])
-    return modes, "Mode{}: {} ({} occurence{})".format("" if len(modes) == 1 else "s", ", ".join(map(str, modes)), max_count, "" if max_count == 1 else "s")
\ No newline at end of file
+class Accumulator:
+    """Summarizes outcomes in a single pass: count, sum, mean, variance (by Welford's method), min, and max.
+    Counts of each outcome are also kept if asked for, as needed for the median and mode.
+    Accumulators can be merged, e.g. to combine the outcomes of separate workers."""
+    __slots__ = ("count", "sum", "mean", "m2", "min", "max", "counts")
+
+    def __init__(self, outcomes=(), keep_counts: bool = False):
+        self.count = 0
+        self.sum = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # sum of squared differences from the mean
+        self.min = None
+        self.max = None
+        self.counts = {} if keep_counts else None
+        for outcome in outcomes:
+            self.add(outcome)
+
+    def add(self, outcome):
+        """Adds a single outcome in O(1) time."""
+        self.count += 1
+        self.sum += outcome
+        delta = outcome - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (outcome - self.mean)
+        if self.min is None or outcome < self.min:
+            self.min = outcome
+        if self.max is None or outcome > self.max:
+            self.max = outcome
+        if self.counts is not None:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+    def merge(self, other: "Accumulator"):
+        """Adds all the outcomes summarized by another accumulator."""
+        if not other.count:
+            return
+        if not self.count:
+            self.count, self.sum, self.mean, self.m2, self.min, self.max = other.count, other.sum, other.mean, other.m2, other.min, other.max
+        else:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self.m2 += other.m2 + delta * delta * self.count * other.count / count
+            self.mean += delta * other.count / count
+            self.count = count
+            self.sum += other.sum
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        if self.counts is not None:
+            for outcome, count in (other.counts or {}).items():
+                self.counts[outcome] = self.counts.get(outcome, 0) + count
+
+    @property
+    def variance(self) -> float:
+        """The sample variance of the outcomes."""
+        return self.m2 / (self.count - 1)
+
+
+# Statistics of an Accumulator, each returning just its value, so that e.g. simulations need not format any output
+
+def _require_outcomes(acc, stat: str):
+    # e.g. a group of only tables has no outcomes to find the mean of
+    if not acc.count:
+        raise ParseException("Failure: there are no outcomes to find the {} of".format(stat))
+
+def mean(acc):
+    _require_outcomes(acc, "mean")
+    return acc.sum / acc.count
+
+def total(acc):
+    return acc.sum
+
+def std(acc):
+    # -1 if there are too few outcomes
+    return acc.variance ** .5 if acc.count >= 2 else -1
+
+def median(acc):
+    _require_outcomes(acc, "median")
+    # find the middle outcome(s) by counting up through the sorted outcomes
+    lower, upper = (acc.count - 1) // 2, acc.count // 2
+    seen = 0
+    for outcome in sorted(acc.counts):
+        if seen <= lower < seen + acc.counts[outcome]:
+            lowerval = outcome
+        if seen <= upper < seen + acc.counts[outcome]:
+            upperval = outcome
+            break
+        seen += acc.counts[outcome]
+    return (lowerval + upperval)/2
+
+def minimum(acc):
+    _require_outcomes(acc, "minimum")
+    return acc.min
+
+def maximum(acc):
+    _require_outcomes(acc, "maximum")
+    return acc.max
+
+def range(acc):
+    _require_outcomes(acc, "range")
+    return acc.max - acc.min
+
+def mode(acc):
+    _require_outcomes(acc, "mode")
+    max_count = max(acc.counts.values())
+    return set([el for el in acc.counts if acc.counts[el] == max_count])
+
+# The output string of each statistic, given its value and the accumulator it was found from
+
+def mean_output(mean, acc) -> str:
+    return "Mean: {}".format(mean)
+
+def total_output(total, acc) -> str:
+    return "Total: {}".format(total)
+
+def std_output(std, acc) -> str:
+    if acc.count < 2:
+        return "Unable to find standard deviation of length-1 list."
+    return "Standard Deviation: {:0.2f}".format(std)
+
+def median_output(median, acc) -> str:
+    return "Median: {}".format(median)
+
+def minimum_output(minv, acc) -> str:
+    return "Minimum: {}".format(minv)
+
+def maximum_output(maxv, acc) -> str:
+    return "Maximum: {}".format(maxv)
+
+def range_output(range, acc) -> str:
+    return "Range: {}".format(range)
+
+def mode_output(modes, acc) -> str:
+    max_count = acc.counts[next(iter(modes))]
+    return "Mode{}: {} ({} occurence{})".format("" if len(modes) == 1 else "s", ", ".join(map(str, modes)), max_count, "" if max_count == 1 else "s")
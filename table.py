@@ -1,15 +1,19 @@
+import os
+import pickle
 import re
 import util
+import render
+import dicerng
+import profiling
+from result import TableResult
 
 # table syntax: {key1=val1;key2=val2}=key
 _table_regex = re.compile(r"{(?P<items>(?:\w*=\w*[;}])+)=(?P<key>\d+)$")
 _item_regex = re.compile(r"(?P<item>\w*=\w*)[;}]")
 
-def is_table(arg: str) -> bool:
-    return _table_regex.match(arg)
-
 class Table(dict):
     def __init__(self, arg: str):
+        profiling.count("regex matches")
         if match := _table_regex.match(arg):
             items = match.group("items")
             self.key = match.group('key')
@@ -20,9 +24,159 @@ class Table(dict):
             item = itemstr.group('item').split('=')
             self[item[0]] = item[1]
     
-    def execute(self, print_output: bool = False):
-        result = self[self.key]
+    # rng is unused, but accepted so that every kind of item can be run alike
+    def run(self, rng=None) -> TableResult:
+        if self.key not in self:
+            raise util.ParseException("Failure: table has no entry for '{}'".format(self.key))
+        return TableResult(self[self.key])
+    
+    def execute(self, print_output: bool = False, rng=None):
+        result = self.run()
         if print_output:
-            print("Outcome of table: " + result)
-        return result
+            print(render.text(result))
+        return result.value
     
+    def evaluate(self, rng=None):
+        return self.execute()
+
+
+# Random tables are read from data files, e.g. tables/loot.txt for '@loot', with one row per line:
+#   3: Goblin ambush      (drawn with weight 3)
+#   01-05: Wild surge     (a range of a d100-style table, drawn with weight 5)
+#   Nothing happens       (drawn with weight 1)
+# Blank lines and lines starting with '#' are skipped.
+tables_dir = os.environ.get("ROLLPY_TABLES", util.PATH_TO_DIR + "/tables")
+tables_file_extension = ".txt"
+# preprocessed tables are saved here, and rebuilt whenever the file they came from changes
+cache_dir = tables_dir + "/__cache__"
+
+_row_regex = re.compile(r"(?:(?P<weight>\d+)|(?P<low>\d+)-(?P<high>\d+))\s*:\s*(?P<value>.*)")
+
+class RandomTable:
+    """A table of rows, each drawn at random with the chance of its weight. Immutable, and shared by every use of the table.\n
+    The rows are preprocessed into an alias table (Vose's alias method), so a draw takes two dice whatever the size of the table:
+    one picks a row uniformly, and the other keeps it or swaps it for its alias, in proportion to its weight."""
+    __slots__ = ("name", "rows", "total", "prob", "alias")
+
+    def __init__(self, name: str, rows: list, weights: list):
+        """rows: the value of each row\n
+        weights: the positive integer weight of each row"""
+        self.name = name
+        self.rows = rows
+        self.total = sum(weights)
+        self.prob, self.alias = _alias_table(weights)
+
+    def draw(self, rng: dicerng.DiceRNG = None) -> str:
+        """Returns the value of a random row."""
+        rng = rng or dicerng.default
+        i = rng.roll(len(self.rows)) - 1
+        if rng.roll(self.total) > self.prob[i]:
+            i = self.alias[i]
+        return self.rows[i]
+
+    def run(self, rng: dicerng.DiceRNG = None) -> TableResult:
+        return TableResult(self.draw(rng), self.name)
+
+    def execute(self, print_output: bool = False, rng: dicerng.DiceRNG = None):
+        result = self.run(rng)
+        if print_output:
+            print(render.text(result))
+        return result.value
+
+    def evaluate(self, rng: dicerng.DiceRNG = None):
+        return self.draw(rng)
+
+    def distribution(self) -> dict:
+        """Returns the chance of each value, so that a table of numbers can fill in blanks."""
+        result = {}
+        for i, row in enumerate(self.rows):
+            # row i is drawn when picked and kept, and as the alias of any row that is picked and swapped
+            result[row] = result.get(row, 0.0) + self.prob[i] / self.total / len(self.rows)
+            alias = self.rows[self.alias[i]]
+            result[alias] = result.get(alias, 0.0) + (self.total - self.prob[i]) / self.total / len(self.rows)
+        return result
+
+def _alias_table(weights: list) -> tuple:
+    """Returns the lists (prob, alias) of Vose's alias method for the given weights, in exact integer arithmetic.
+    Row i is kept when a die with sum(weights) faces rolls at most prob[i], and swapped for row alias[i] otherwise."""
+    n, total = len(weights), sum(weights)
+    # each row is a bucket that holds total, filled with n times its weight, then topped up from the rows that overflow
+    scaled = [weight * n for weight in weights]
+    prob, alias = [total] * n, list(range(n))
+    small = [i for i, size in enumerate(scaled) if size < total]
+    large = [i for i, size in enumerate(scaled) if size >= total]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        prob[less], alias[less] = scaled[less], more
+        scaled[more] -= total - scaled[less]
+        (small if scaled[more] < total else large).append(more)
+    return prob, alias
+
+def _parse_rows(name: str, lines) -> tuple:
+    """Returns the lists (rows, weights) of the lines of a table file."""
+    rows, weights = [], []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if match := _row_regex.fullmatch(line):
+            if match.group("weight"):
+                weight = int(match.group("weight"))
+            else:
+                weight = int(match.group("high")) - int(match.group("low")) + 1
+            line = match.group("value")
+        else:
+            weight = 1
+        if weight < 1:
+            raise util.ParseException("Failure: row {} of table '{}' must have a positive weight".format(number, name))
+        rows.append(line)
+        weights.append(weight)
+    if not rows:
+        raise util.ParseException("Failure: table '{}' has no rows".format(name))
+    return rows, weights
+
+# map from name to (mtime, size, table) of each table loaded by this process
+_loaded = {}
+
+def load_table(name: str) -> RandomTable:
+    """Returns the random table with the given name, e.g. 'loot' for tables/loot.txt.
+    The file is only parsed again when it has changed, and is otherwise loaded from memory or from the cache on disk."""
+    path = os.path.join(tables_dir, name + tables_file_extension)
+    # names like '/etc/secret' would otherwise read files from anywhere, e.g. for any client of the server
+    root = os.path.realpath(tables_dir)
+    if os.path.commonpath([root, os.path.realpath(path)]) != root:
+        raise util.ParseException("Failure: table '{}' is not in {}".format(name, tables_dir))
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise util.ParseException("Failure: no table named '{}' (expected {})".format(name, path))
+    key = (stat.st_mtime_ns, stat.st_size)
+    if (loaded := _loaded.get(name)) and loaded[0] == key:
+        return loaded[1]
+
+    cache_path = os.path.join(cache_dir, name.replace("/", ".") + ".pickle")
+    result = None
+    try:
+        with open(cache_path, "rb") as fp:
+            profiling.count("file reads")
+            cached_key, cached = pickle.load(fp)
+        if cached_key == key:
+            result = cached
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError, AttributeError):
+        pass # rebuilt below
+
+    if result is None:
+        profiling.count("file reads")
+        with open(path) as fp:
+            result = RandomTable(name, *_parse_rows(name, fp))
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_path, "wb") as fp:
+                pickle.dump((key, result), fp, pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass # the cache is only for speed
+    _loaded[name] = (key, result)
+    return result
+
+# the kinds of table, whose outcomes are not numbers, so are left out of a group's total and stats
+table_types = (Table, RandomTable)
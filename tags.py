@@ -1,6 +1,10 @@
 import re
-from statistic import *
+from functools import lru_cache
+from typing import NamedTuple
+import statistic
 from util import ParseException
+import distribution
+import profiling
 
 YIELD = "-yield"
 
@@ -17,51 +21,126 @@ HIDE = "-hide"
 VERBOSE = "-verbose"
 NICE = "-nice"
 
+PROB = "-prob"
+SIM = "-sim"
+WORKERS = "-workers"
+SEED = "-seed"
+
 special_tag_strs = [YIELD]
 stat_tag_strs = [TOTAL, MEAN, STD, MEDIAN, MODE, RANGE, MAX, MIN]
 print_tag_strs = [HIDE, VERBOSE, NICE]
+query_tag_strs = [PROB, SIM]
+option_tag_strs = [WORKERS, SEED]
 supertag_strs = ["-" + tag for tag in stat_tag_strs + print_tag_strs + special_tag_strs]
 
-all_tag_strs = special_tag_strs + stat_tag_strs + print_tag_strs + supertag_strs
+# tags that are followed by a number, which is not itself an item of the group
+numbered_tag_strs = [SIM, WORKERS, SEED]
+
+# stats that need the count of each outcome, not just a running summary
+count_stat_strs = [MEDIAN, MODE]
+
+all_tag_strs = special_tag_strs + stat_tag_strs + print_tag_strs + query_tag_strs + option_tag_strs + supertag_strs
+
+# tags that are either present or not are kept as bits of a single int; the rest are kept as values in a TagSet
+flag_tag_strs = stat_tag_strs + print_tag_strs + supertag_strs
+bits = {tag: 1 << i for i, tag in enumerate(flag_tag_strs)}
+supertag_bits = sum(bits[tag] for tag in supertag_strs)
 
 _tag_regex = re.compile(r"^--?\w+$")
 def isTag(s: str) -> bool:
     """Returns whether or not the given string is a possible tag."""
+    profiling.count("regex matches")
     return not _tag_regex.match(s) is None
 
-class Tag:
-    """A superclass for all tags. All tags have an associated content (usually just True, but could also be a formula or another tag)"""
-    def __init__(self, keystr: str, contents=True):
-        """keystr: the tag, e.g. '-mean'\n
-        contents: what the tag contains; contains True by default."""
-        self.contents = contents
-        self.keystr = keystr
+_prob_regex = re.compile(r"^-prob(?P<op>>=|<=|>|<|=)(?P<target>-?\d+)$")
 
-    def clone(self):
-        return Tag(self.keystr, contents=self.contents)
+# the value of each stat tag over the outcomes in an accumulator, and its output string given that value
+formulae = {MEAN:statistic.mean, TOTAL:statistic.total, STD:statistic.std, MEDIAN:statistic.median, MIN:statistic.minimum, MAX:statistic.maximum, RANGE:statistic.range, MODE:statistic.mode}
+outputs = {MEAN:statistic.mean_output, TOTAL:statistic.total_output, STD:statistic.std_output, MEDIAN:statistic.median_output, MIN:statistic.minimum_output, MAX:statistic.maximum_output, RANGE:statistic.range_output, MODE:statistic.mode_output}
 
+def calculate(stat: str, acc: statistic.Accumulator) -> tuple:
+    """Returns the tuple (value, output string) of the given stat tag over the outcomes in acc."""
+    value = formulae[stat](acc)
+    return value, outputs[stat](value, acc)
 
-_formulae = {MEAN:mean, TOTAL:total, STD:std, MEDIAN:median, MIN:minimum, MAX:maximum, RANGE:range, MODE:mode}
-class Statistic(Tag):
-    """A tag that corresponds to a statistical value."""
-    def __init__(self, keystr):
-        super().__init__(keystr, contents=_formulae[keystr])
-    
-    def calculate(self, ls: list):
-        self.__value, self.output = self.contents(ls)
-    
-    def print(self):
-        print(self.output)
-    
-    def value(self):
-        return self.__value
-    
-    def clone(self):
-        return Statistic(self.keystr)
+def probability(prob: tuple, dist: dict) -> tuple:
+    """Returns the tuple (tag, value, output string) for the chance asked for by a '-prob' tag, given as (op, target), of the given distribution."""
+    op, target = prob
+    value = distribution.chance(dist, op, target)
+    return PROB + op + str(target), value, "Chance of {}{}: {:.2%}".format(op, target, value)
+
+default_sim_stat_strs = (MEAN, STD, MIN, MAX)
+
+class TagSet(NamedTuple):
+    """The tags of a group. Immutable, and shared between groups with the same tags.\n
+    flags: the bits (see bits) of every tag that is present\n
+    yield_stat: the stat tag that the group yields, e.g. '-mean'\n
+    prob: the (op, target) asked for with '-prob', if any\n
+    trials: the number of trials asked for with '-sim', or 0\n
+    sim_stats: the stat tags reported by a simulation\n
+    workers, seed: the numbers given with '-workers' and '-seed', if any"""
+    flags: int = 0
+    yield_stat: str = TOTAL
+    prob: tuple = None
+    trials: int = 0
+    sim_stats: tuple = ()
+    workers: int = None
+    seed: int = None
+
+    @staticmethod
+    def of(found: dict, sim_stats: tuple = ()) -> "TagSet":
+        """Returns the tag set of the given map from tag to value, as returned by parse_tag()."""
+        flags = 0
+        for tag in found:
+            flags |= bits.get(tag, 0)
+        return _intern(TagSet(flags, found.get(YIELD, TOTAL), found.get(PROB), found.get(SIM, 0), tuple(sim_stats), found.get(WORKERS), found.get(SEED)))
+
+    def has(self, tag: str) -> bool:
+        """Returns whether the given tag, which is either present or not (e.g. '-hide'), is present."""
+        return bool(self.flags & bits[tag])
+
+    def stats(self) -> list:
+        """Returns the stat tags that are present, in order."""
+        return [stat for stat in stat_tag_strs if self.flags & bits[stat]]
+
+    def inherit(self, parent: "TagSet") -> "TagSet":
+        """Returns this tag set with the tag of each of the parent's supertags added, e.g. '-verbose' for '--verbose'."""
+        added, yield_stat = _inherited(parent.flags & supertag_bits, parent.yield_stat)
+        flags, yield_stat = self.flags | added, yield_stat or self.yield_stat
+        if flags == self.flags and yield_stat == self.yield_stat:
+            return self
+        return _intern(self._replace(flags=flags, yield_stat=yield_stat))
+
+@lru_cache(maxsize=256)
+def _inherited(superflags: int, yield_stat: str) -> tuple:
+    # returns the bits added by the given supertag bits, and the stat to yield if '--yield' is one of them
+    added, inherited_yield = 0, None
+    for supertag in supertag_strs:
+        if superflags & bits[supertag]:
+            tag = supertag[1:]
+            if tag == YIELD:
+                inherited_yield = yield_stat
+                added |= bits[yield_stat]
+            else:
+                added |= bits[tag]
+    return added, inherited_yield
+
+@lru_cache(maxsize=1024)
+def _intern(tagset: TagSet) -> TagSet:
+    # returns the first of the equal tag sets seen, so that they are shared
+    return tagset
 
-def get_tag(keystr: str, remaining_args: list) -> Tag:
+def parse_tag(keystr: str, remaining_args: list) -> tuple:
+    """Returns a tuple (tag, value) for the given tag, e.g. ('-mean', True), ('-sim', 1000), or ('-prob', ('>=', 15)).
+    remaining_args: the args after the tag, which some tags take a value from.
+    Raises a ParseException if the tag is invalid."""
+    profiling.count("regex matches")
+    if match := _prob_regex.match(keystr):
+        return PROB, (match.group("op"), int(match.group("target")))
+    if keystr.startswith(PROB):
+        raise ParseException("'{}' must be followed by a comparison, e.g. {}>=15".format(PROB, PROB))
     if not isTag(keystr):
-        return None
+        raise ParseException("Invalid tag: {}".format(keystr))
     
     if keystr in special_tag_strs:
         if not remaining_args:
@@ -70,10 +149,20 @@ def get_tag(keystr: str, remaining_args: list) -> Tag:
             nextarg = remaining_args[0]
             if nextarg not in stat_tag_strs:
                 raise ParseException("Unable to yield arg: {}. Arg must be a valid stat tag, such as '{}' or '{}'.".format(nextarg, MEAN, TOTAL))
-            return Tag(keystr, contents=nextarg)
-    if keystr in stat_tag_strs:
-        return Statistic(keystr)
+            return keystr, nextarg
+    if keystr == SIM:
+        if not remaining_args or not remaining_args[0].isdigit() or int(remaining_args[0]) < 1:
+            raise ParseException("'{}' must be followed by a positive number of trials.".format(SIM))
+        return keystr, int(remaining_args[0])
+    if keystr == WORKERS:
+        if not remaining_args or not remaining_args[0].isdigit():
+            raise ParseException("'{}' must be followed by a number of worker processes, or 0 to use every core.".format(WORKERS))
+        return keystr, int(remaining_args[0])
+    if keystr == SEED:
+        if not remaining_args or not remaining_args[0].isdigit():
+            raise ParseException("'{}' must be followed by a non-negative integer seed.".format(SEED))
+        return keystr, int(remaining_args[0])
     if keystr in all_tag_strs:
-        return Tag(keystr)
+        return keystr, True
     
-    raise ParseException("Invalid tag: {}".format(keystr))
\ No newline at end of file
+    raise ParseException("Invalid tag: {}".format(keystr))
@@ -1,4 +1,4 @@
-from os import path
+from os import path, environ
 import re
 
 # Utility fields
@@ -6,6 +6,7 @@ import re
 PATH_TO_DIR = path.dirname(path.realpath(__file__))
 LEFT_PAREN = "["
 RIGHT_PAREN = "]"
+SOCKET_PATH = environ.get("ROLLPY_SOCKET", PATH_TO_DIR + "/.rollpy.sock")
 
 
 
@@ -27,23 +28,6 @@ def make_bold(s: str) -> str:
 class ParseException(Exception):
     pass
 
-def expand(ls: list, expanders: list):
-    """Expands entries in a list until none are expandable any more.\n
-    ls: the list to be expanded
-    expanders: a list of functions that map an element to a list of elements
-    """
-    i = 0
-    while i < len(ls): # loop through elements one at a time, and don't move on to the next until the current element does not expand
-        j = 0
-        while j < len(expanders): # attempt to expand the current element with each function
-            newargs = expanders[j](ls[i])
-            if ls[i:i+1] != newargs:
-                ls[i:i+1] = newargs
-                j = 0 # loop through the functions again on the new element
-            else:
-                j += 1
-        i += 1
-
 def list_get(ls: list, index: int, default_func=None, default=None):
     if index < len(ls):
         return ls[index]